@@ -0,0 +1,262 @@
+from typing import List, Dict, Tuple, Any
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import argparse
+import datetime
+import platform
+import resource
+import random
+import string
+import json
+import time
+import sys
+import os
+
+import compression_file
+import decompression_file
+from huffman_format import ContainerHeader, TABLE_CANONICAL, TABLE_BYTES
+
+# Benchmark harness for compression_file.py and decompression_file.py.
+#
+# Every (corpus, mode) case runs in a fresh worker process, so its peak RSS is measured on its own.
+# The case encodes the corpus file, decodes it back, checks the round trip and reports throughput,
+# peak memory, header size and compression ratio as JSON. --save writes the report, --baseline compares
+# against a saved report and exits with 1 when a case regressed by more than --tolerance.
+# The report's "tradeoffs" put every mode's ratio and speed next to REFERENCE_MODE on the same corpus.
+
+ALICE_PATH: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Alice_in_wonderlands.txt")
+
+# mode name -> (compress_file() keyword arguments, decompress_file() keyword arguments)
+MODES: Dict[str, Dict[str, Dict[str, Any]]] = {
+    "canonical":    {"encode": {}, "decode": {}},
+    "tree-table":   {"encode": {"code_table": "tree"}, "decode": {}},
+    "tree-walk":    {"encode": {}, "decode": {"engine": "tree"}},
+    "table-12":     {"encode": {}, "decode": {"table_bits": 12}},
+    "blocks":       {"encode": {"block_size": 1 << 18}, "decode": {}},
+    "seek-index":   {"encode": {"seek_interval": compression_file.SEEK_INTERVAL}, "decode": {}},
+    "legacy-text":  {"encode": {"legacy_text": True}, "decode": {"legacy_text": True}},
+    "adaptive":     {"encode": {"code_table": "adaptive"}, "decode": {}},
+    "limit-15":     {"encode": {"max_code_length": 15}, "decode": {}},
+    "limit-12":     {"encode": {"max_code_length": 12}, "decode": {}},
+    "bytes":        {"encode": {"byte_symbols": True}, "decode": {}},
+    "streams-4":    {"encode": {"streams": 4}, "decode": {}},
+    "context":      {"encode": {"code_table": "context"}, "decode": {}},
+}
+
+# Mode every other mode is compared to in the tradeoffs of the report.
+REFERENCE_MODE: str = "canonical"
+
+# Corpora that aren't UTF-8 text, only run in the byte symbol modes.
+BINARY_CORPORA: List[str] = ["binary"]
+
+# code_table values whose files engine="tree" can't decode (see HuffmanDecoder.check_engine()), neither can it
+# decode block mode files. Modes that combine them with the tree walk are skipped.
+TABLE_ENGINE_ONLY: List[str] = [compression_file.ADAPTIVE, compression_file.CONTEXT]
+
+# metric -> direction that counts as better, used by compare()
+METRICS: Dict[str, str] = {
+    "encode_mb_s": "higher",
+    "decode_mb_s": "higher",
+    "ratio": "lower",
+    "peak_rss_mb": "lower",
+}
+
+
+def write_text(path: str, text: str) -> str:
+    with open(file=path, mode='w', encoding='utf-8', newline='') as fd:
+        fd.write(text)
+    return path
+
+
+def generate_corpora(directory: str, size: int, seed: int = 0) -> Dict[str, str]:
+    # Returns corpus name -> file path. Generated corpora are about `size` characters long.
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    with open(file=ALICE_PATH, mode='r', encoding='utf-8') as fd:
+        alice = fd.read()
+    corpora: Dict[str, str] = dict()
+    corpora["alice"] = ALICE_PATH
+    corpora["alice-scaled"] = write_text(os.path.join(directory, "alice_scaled.txt"), alice * max(1, size // len(alice)))
+    # Zipf-like skew over letters, space and newline
+    alphabet = "etaoinshrdlucmfwypvbgkjqxz \n"
+    weights = [1 / (rank + 1) ** 1.2 for rank in range(len(alphabet))]
+    corpora["skewed"] = write_text(os.path.join(directory, "skewed.txt"), ''.join(rng.choices(alphabet, weights=weights, k=size)))
+    corpora["single-symbol"] = write_text(os.path.join(directory, "single_symbol.txt"), "a" * size)
+    # Hebrew, CJK and emoji, 2 to 4 bytes per character in UTF-8
+    wide = [chr(code) for code in range(0x05D0, 0x05EB)] + [chr(code) for code in range(0x4E00, 0x4E80)] + [chr(code) for code in range(0x1F600, 0x1F640)]
+    corpora["wide-unicode"] = write_text(os.path.join(directory, "wide_unicode.txt"), ''.join(rng.choices(wide + [" ", "\n"], k=size // 3)))
+    # Fibonacci frequencies give the deepest possible tree, one level per letter
+    counts: List[int] = [1, 1]
+    while sum(counts) + counts[-1] + counts[-2] <= size and len(counts) < 52:
+        counts.append(counts[-1] + counts[-2])
+    deep = list(''.join(letter * count for letter, count in zip(string.ascii_letters, counts)))
+    rng.shuffle(deep)
+    corpora["deep-tree"] = write_text(os.path.join(directory, "deep_tree.txt"), ''.join(deep))
+    # skewed bytes over the whole byte range with CRLF line breaks, like an executable or an image header
+    binary = bytes(rng.choices(range(256), weights=[1 / (byte + 1) for byte in range(256)], k=size)).replace(b"\n", b"\r\n")
+    corpora["binary"] = os.path.join(directory, "binary.bin")
+    with open(file=corpora["binary"], mode='wb') as fd:
+        fd.write(binary)
+    return corpora
+
+
+def run_case(corpus: str, source_path: str, mode: str, work_dir: str) -> Dict[str, Any]:
+    # Runs in a fresh worker process, see run_isolated().
+    options = MODES[mode]
+    compressed_path = os.path.join(work_dir, f"{corpus}.{mode}.huf")
+    decompressed_path = os.path.join(work_dir, f"{corpus}.{mode}.out")
+    original_bytes = os.path.getsize(source_path)
+    result: Dict[str, Any] = {"corpus": corpus, "mode": mode, "original_bytes": original_bytes}
+    try:
+        start = time.perf_counter()
+        compression_file.compress_file(source_path, compressed_path, **options["encode"])
+        encode_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        decompression_file.decompress_file(compressed_path, decompressed_path, **options["decode"])
+        decode_seconds = time.perf_counter() - start
+    except (Exception, SystemExit) as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        return result
+
+    if options["encode"].get("byte_symbols") is True:
+        # byte for byte, newlines included
+        with open(file=source_path, mode='rb') as original_fd, open(file=decompressed_path, mode='rb') as decompressed_fd:
+            round_trip = original_fd.read() == decompressed_fd.read()
+    else:
+        with open(file=source_path, mode='r', encoding='utf-8') as original_fd, open(file=decompressed_path, mode='r', encoding='utf-8') as decompressed_fd:
+            round_trip = original_fd.read() == decompressed_fd.read()
+    compressed_bytes = os.path.getsize(compressed_path)
+    header_bytes, max_code_bits = header_info(compressed_path, options)
+    result.update({
+        "compressed_bytes": compressed_bytes,
+        "header_bytes": header_bytes,
+        "max_code_bits": max_code_bits,
+        "ratio": round(compressed_bytes / original_bytes, 4) if original_bytes else None,
+        "encode_mb_s": round(original_bytes / 1e6 / encode_seconds, 3),
+        "decode_mb_s": round(original_bytes / 1e6 / decode_seconds, 3),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "round_trip": round_trip,
+    })
+    os.remove(compressed_path)
+    os.remove(decompressed_path)
+    return result
+
+
+def header_info(compressed_path: str, options: Dict[str, Dict[str, Any]]) -> Tuple[int, int]:
+    # Returns the header size in bytes and the longest code length when the table is canonical (else None).
+    if options["decode"].get("legacy_text") is True:
+        # the legacy footer is everything after the first line
+        with open(file=compressed_path, mode='r', encoding='utf-8') as fd:
+            fd.readline()
+            return len(fd.read().encode('utf-8')), None
+    with open(file=compressed_path, mode='rb') as fd:
+        header = ContainerHeader.from_fd(fd)
+        max_code_bits = header.table[0] if header.table_kind in (TABLE_CANONICAL, TABLE_BYTES) and header.table else None
+        return fd.tell(), max_code_bits
+
+
+def tree_walk_supported(encode_options: Dict[str, Any]) -> bool:
+    if encode_options.get("block_size") is not None or encode_options.get("streams") is not None:
+        return False
+    return encode_options.get("code_table") not in TABLE_ENGINE_ONLY
+
+
+def run_isolated(corpus: str, source_path: str, mode: str, work_dir: str) -> Dict[str, Any]:
+    # A fresh spawned process per case, so ru_maxrss is the peak of that case alone.
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(run_case, corpus, source_path, mode, work_dir).result()
+
+
+def run_benchmark(corpora: Dict[str, str], modes: List[str], work_dir: str) -> Dict[str, Any]:
+    results: List[Dict[str, Any]] = list()
+    for corpus, source_path in corpora.items():
+        for mode in modes:
+            if corpus in BINARY_CORPORA and MODES[mode]["encode"].get("byte_symbols") is not True:
+                continue
+            if MODES[mode]["decode"].get("engine") == "tree" and not tree_walk_supported(MODES[mode]["encode"]):
+                continue
+            result = run_isolated(corpus, source_path, mode, work_dir)
+            print(json.dumps(result), file=sys.stderr)
+            results.append(result)
+    return {
+        "meta": {
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+        "tradeoffs": tradeoffs(results),
+    }
+
+
+def tradeoffs(results: List[Dict[str, Any]]) -> Dict[str, Dict[str, Dict[str, float]]]:
+    # corpus -> mode -> ratio change and speed factors against REFERENCE_MODE, e.g. the ratio an order-1 context model
+    # gains on text and the decode speed it costs
+    reference = {result["corpus"]: result for result in results if result["mode"] == REFERENCE_MODE and "error" not in result}
+    summary: Dict[str, Dict[str, Dict[str, float]]] = dict()
+    for result in results:
+        base = reference.get(result["corpus"])
+        if base is None or result["mode"] == REFERENCE_MODE or "error" in result or not base.get("ratio"):
+            continue
+        summary.setdefault(result["corpus"], dict())[result["mode"]] = {
+            "ratio_change": round((result["ratio"] - base["ratio"]) / base["ratio"], 4),
+            "encode_speed": round(result["encode_mb_s"] / base["encode_mb_s"], 3),
+            "decode_speed": round(result["decode_mb_s"] / base["decode_mb_s"], 3),
+        }
+    return summary
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    # Returns a line for every metric of every case that got worse than the baseline by more than `tolerance`.
+    baseline_results = {(result["corpus"], result["mode"]): result for result in baseline["results"]}
+    regressions: List[str] = list()
+    for result in report["results"]:
+        key = (result["corpus"], result["mode"])
+        if key not in baseline_results:
+            continue
+        if "error" in result or result.get("round_trip") is False:
+            regressions.append(f"{key[0]}/{key[1]}: failed ({result.get('error', 'round trip mismatch')})")
+            continue
+        old = baseline_results[key]
+        for metric, better in METRICS.items():
+            if old.get(metric) is None or result.get(metric) is None:
+                continue
+            change = (result[metric] - old[metric]) / old[metric] if old[metric] else 0.0
+            worse = -change if better == "higher" else change
+            if worse > tolerance:
+                regressions.append(f"{key[0]}/{key[1]}: {metric} {old[metric]} -> {result[metric]} ({change:+.1%})")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark Huffman compression and decompression.")
+    parser.add_argument("--size", type=int, default=1 << 21, help="characters per generated corpus (default 2M)")
+    parser.add_argument("--corpora", nargs="*", help="corpus names to run (default all)")
+    parser.add_argument("--modes", nargs="*", default=list(MODES), help=f"modes to run, from {list(MODES)}")
+    parser.add_argument("--work-dir", default="bench_corpora", help="directory for generated corpora and outputs")
+    parser.add_argument("--save", help="write the JSON report to this path")
+    parser.add_argument("--baseline", help="compare against a saved JSON report")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative regression (default 0.10)")
+    args = parser.parse_args()
+
+    corpora = generate_corpora(args.work_dir, args.size)
+    if args.corpora:
+        corpora = {name: path for name, path in corpora.items() if name in args.corpora}
+    report = run_benchmark(corpora, args.modes, args.work_dir)
+    print(json.dumps(report, indent=2))
+    if args.save:
+        with open(file=args.save, mode='w', encoding='utf-8') as fd:
+            json.dump(report, fd, indent=2)
+    if args.baseline:
+        with open(file=args.baseline, mode='r', encoding='utf-8') as fd:
+            regressions = compare(report, json.load(fd), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,120 +1,109 @@
-from typing import List, Dict
-import heapq
+from typing import List, Dict, Tuple, TextIO, BinaryIO
+from collections import Counter
+from contextlib import nullcontext
+import tempfile
+import shutil
 import sys
+import io
 import os
 
+from huffman_format import HuffmanError, ContainerHeader, CHUNK_SIZE, FLUSH_BITS, flush_bytes, parse_int_option, BlockIndex, SeekIndex, SegmentIndex, TABLE_TREE, TABLE_CANONICAL, TABLE_MODEL, TABLE_BYTES, TABLE_PREVIOUS, FLAG_BLOCKS, FLAG_SEEK_INDEX, FLAG_STREAMS, FLAG_SEGMENTS, FLAGS_OFFSET, pack_tree_table, pack_canonical_table, pack_byte_table, unpack_canonical_table, unpack_byte_table
+from huffman_codes import canonical_order, canonical_codes, code_to_path, limited_code_lengths, check_max_code_length
+from huffman_parallel import ordered_map
+from huffman_histogram import char_histogram, byte_histogram, count_bytes
+from huffman_model import HuffmanModel
+from huffman_mapped import map_file, MappedSource
+from huffman_adaptive import AdaptiveEncoder, compress_adaptive, adaptive_header
+from huffman_context import compress_context, compress_context_text
+from huffman_tree import CodeTree
+from huffman_profile import profile_stage, profiling, write_profile
+
+# Number of characters per independently encoded block in block mode.
+BLOCK_SIZE: int = 1 << 20
+# Default number of characters between two seek index checkpoints.
+SEEK_INTERVAL: int = 1 << 14
+# Characters every trained model has a code for even when the samples never use them,
+# so typical messages don't fall back to carrying their own table.
+MODEL_BASE_ALPHABET: str = ''.join(chr(num) for num in range(0x20, 0x7F)) + "\n\t\r"
+# Number of interleaved streams per block of --streams.
+STREAMS: int = 4
+# code_table of the single pass adaptive mode (see huffman_adaptive.py), which doesn't go through HuffmanEncoder.
+ADAPTIVE: str = "adaptive"
+# code_table of the order-1 context mode (see huffman_context.py), which doesn't go through HuffmanEncoder either.
+CONTEXT: str = "context"
+
 # Text file doesn't contain any numbers, which means that all non-leaf nodes can have a number as a unique value.
 # We will us counting up like in the example.
 class UniqueValue:
     count_up = 0
 
-    def __init__(self, depth: int, path: str) -> None:
-        self.depth: int = depth
-        self.path: str = path
-        self.char: str = None
-        self.number: int = None
-    
-    def __str__(self) -> str:
-        # tmp = f"d{self.depth}p{self.path}c"
-        # if self.char is not None:
-        #     tmp += self.char
-        # return tmp
-        if self.char is not None:
-            return self.char
-        elif self.number is not None:
-            return str(self.number)
-        else:
-            return "yet to be assigned"
-        
-    def update_number(self) -> None:
-        self.number = self.get_increase_count()
-
     @classmethod
     def get_increase_count(cls) -> int:
         tmp = cls.count_up
         cls.count_up += 1
         return tmp
 
-class HT_Node:
-    def __init__(self, freq: int, char: str=None, smaller_child: "HT_Node"=None, bigger_child: "HT_Node"=None) -> None:
-        self.char = char
-        self.freq: int = freq
-        self.smaller_child: "HT_Node" = smaller_child
-        self.bigger_child: "HT_Node" = bigger_child
-        self.is_leaf: bool = self.char is not None
-        self.unique_value: UniqueValue = None
-        self.check_attributes()
-
-    def __lt__(self, other: "HT_Node") -> bool:
-        return self.freq < other.freq
-    
-    def __add__(self, other: "HT_Node") -> "HT_Node":
-        return HT_Node(char=None, freq=self.freq + other.freq, smaller_child=self, bigger_child=other)
-
-    def __repr__(self) -> str:
-        return f"HT_Node(char={self.char}, freq={self.freq}, unique_value={self.unique_value})"
-
-    def check_attributes(self):
-        if self.is_leaf is True: # node is a leaf
-            if len(self.char) != 1: # self.char is not a single char
-                print(f"self.char isn't a single character, len(self.char) = {self.char}")
-                exit(1)
-        if self.freq <= 0:
-            print(f"frequency doesn't make sense, self.freq = {self.freq}")
-            exit(1)
-
-    def assign_children_unique_values(self):        
-        if self.is_leaf is True:
-            self.unique_value.char = self.char
-            # print(f"assigned leaf = {self}")
-        else:
-            self.unique_value.update_number()
-            self.smaller_child.unique_value = UniqueValue(depth=self.unique_value.depth + 1, 
-                                                          path=self.unique_value.path + "0")
-            # print(f"smaller_child = {self.smaller_child}")
-            self.smaller_child.assign_children_unique_values()
-
-            self.bigger_child.unique_value = UniqueValue(depth=self.unique_value.depth + 1, 
-                                                          path=self.unique_value.path + "1")
-            # print(f"bigger_child = {self.bigger_child}")
-            self.bigger_child.assign_children_unique_values()
-        # print(self)
-
-    def list_nodes_in_order(self) -> List["HT_Node"]:
-        if self.is_leaf is True:
-            return [self]
-        return self.smaller_child.list_nodes_in_order() + [self] + self.bigger_child.list_nodes_in_order()
-    
-    def list_nodes_pre_order(self) -> List["HT_Node"]:
-        if self.is_leaf is True:
-            return [self]
-        return [self] + self.smaller_child.list_nodes_pre_order() + self.bigger_child.list_nodes_pre_order()
-
-    def fill_encode_dict(self, encoding_dict: "HT_Node"):
-        if self.is_leaf is True:
-            encoding_dict[self.char] = self
-            return
-        self.smaller_child.fill_encode_dict(encoding_dict)
-        self.bigger_child.fill_encode_dict(encoding_dict)
-
 class HuffmanTree:
-    def __init__(self, text_file_path: str) -> None:
+    # Either text_file_path is read to count the characters, or a ready char_historgram is given (see compress_stream()).
+    # histogram_workers is the number of processes counting a large file, all cores by default.
+    # max_code_length caps the canonical code lengths (package-merge) when the tree is deeper than that.
+    # previous_ordered is the canonical table of the segment an appended file ends with (see append_file() and reuse_table()).
+    def __init__(self, text_file_path: str = None, char_historgram: Dict[str, int] = None, histogram_workers: int = None,
+                 max_code_length: int = None, previous_ordered: List[Tuple[str, int]] = None) -> None:
         self.text_file_path: str = text_file_path
+        self.histogram_workers: int = histogram_workers
+        self.max_code_length: int = check_max_code_length(max_code_length)
+        self.length_limited: bool = False               # True when the code lengths no longer match the tree paths
+        self.table_reused: bool = False                 # True when the canonical table is previous_ordered, see reuse_table()
         self.char_historgram: Dict[str, int] = dict()   # created by: create_histogram()
-        self.node_min_heap: List[HT_Node]               # created by: historgram_to_min_heap()
-        self.root: HT_Node                              # created by: build_tree()
+        self.tree: CodeTree                             # created by: build_tree()
+        self.unique_values: List[str] = None            # created by: assign_unique_values(), indexed by node, only for legacy_orders()
+        self.tree_codes: Dict[str, Tuple[int, int]]     # created by: build_tree(), char -> (code, length) of the tree path
 
-        self.create_histogram()
-        self.historgram_to_min_heap()
-        # print(self)
-        self.build_tree()
-        # print(f"HuffmanTree's root = {self.root}")
-        self.assign_unique_values()
-
-        self.in_order_unique_values = ','.join([node.unique_value.__str__() for node in self.root.list_nodes_in_order()])
-        # print(f"\nInorder={{{self.in_order_unique_values}}}")
-        self.pre_order_unique_values = ','.join([node.unique_value.__str__() for node in self.root.list_nodes_pre_order()])
-        # print(f"\nPreorder={{{self.pre_order_unique_values}}}")
+        if char_historgram is not None:
+            self.char_historgram = dict(char_historgram)
+        else:
+            self.create_histogram()
+        if not self.char_historgram:
+            self.make_empty()
+            return
+        with profile_stage("tree") as stage:
+            self.build_tree()
+            stage.add(nodes=len(self.tree))
+
+        with profile_stage("code table") as stage:
+            self.code_lengths: Dict[str, int] = self.leaf_code_lengths()
+            if max_code_length is not None and max(self.code_lengths.values()) > max_code_length:
+                self.code_lengths = limited_code_lengths(self.char_historgram, max_code_length)
+                self.length_limited = True
+            self.canonical_ordered: List[Tuple[str, int]] = canonical_order(self.code_lengths)
+            self.canonical_table: bytes = pack_canonical_table(self.canonical_ordered)
+            if previous_ordered is not None:
+                self.reuse_table(previous_ordered)
+            stage.add(symbols=len(self.code_lengths))
+
+    def make_empty(self) -> None:
+        # Empty input: no tree, empty code tables and an empty payload.
+        self.tree = CodeTree()
+        self.tree_codes = dict()
+        self.code_lengths = dict()
+        self.canonical_ordered = list()
+        self.canonical_table = pack_canonical_table(self.canonical_ordered)
+
+    def reuse_table(self, previous_ordered: List[Tuple[str, int]]) -> None:
+        # An appended segment keeps the canonical table of the segment before it, and doesn't store it again, when that table
+        # has a code for every character and its payload is no bigger than the payload and the table of new codes.
+        previous_lengths: Dict[str, int] = dict(previous_ordered)
+        if any(char not in previous_lengths for char in self.char_historgram):
+            return
+        previous_bits = sum(freq * previous_lengths[char] for char, freq in self.char_historgram.items())
+        new_bits = sum(freq * self.code_lengths[char] for char, freq in self.char_historgram.items()) + 8 * len(self.canonical_table)
+        if previous_bits > new_bits:
+            return
+        self.code_lengths = previous_lengths
+        self.canonical_ordered = list(previous_ordered)
+        self.canonical_table = pack_canonical_table(self.canonical_ordered)
+        self.table_reused = True
 
     def __repr__(self) -> str:
         repr_str: str = ""
@@ -122,8 +111,7 @@ class HuffmanTree:
         
         attr_list.append(f"text_file_path   = {self.text_file_path}")
         attr_list.append(f"char_historgram  = {self.char_historgram}")
-        attr_list.append(f"node_min_heap    = {self.node_min_heap}")
-        attr_list.append(f"sorted_node_list = {sorted(self.node_min_heap)}")
+        attr_list.append(f"tree             = {self.tree}")
 
         repr_str += "HuffmanTree(\n\t"
         repr_str += ',\n\n\t'.join(attr_list)
@@ -131,34 +119,55 @@ class HuffmanTree:
         return repr_str
 
     def create_histogram(self) -> "HuffmanTree":
-        with open(file=self.text_file_path, mode='r', encoding='utf-8') as fd:
-            for line in fd:
-                for char in line:
-                    if char not in self.char_historgram:
-                        self.char_historgram[char] = 1
-                    else:
-                        self.char_historgram[char] += 1
-
-    def historgram_to_min_heap(self) -> None:
-        self.node_min_heap = [HT_Node(char=char, freq=freq) for char, freq in self.char_historgram.items()]
-        heapq.heapify(self.node_min_heap)
-
-    def build_tree(self) -> HT_Node:
-        while(len(self.node_min_heap) > 1):
-            smaller_node = heapq.heappop(self.node_min_heap)
-            bigger_node = heapq.heappop(self.node_min_heap)
-            papa_node = smaller_node + bigger_node # The order matters
-            heapq.heappush(self.node_min_heap, papa_node)
-        self.root = self.node_min_heap[0]
+        self.char_historgram = char_histogram(self.text_file_path, workers=self.histogram_workers)
+
+    @staticmethod
+    def stream_histogram(source_fd: TextIO, chunk_size: int = CHUNK_SIZE) -> Dict[str, int]:
+        char_historgram: Counter = Counter()
+        with profile_stage("histogram") as stage:
+            for chunk in iter(lambda: source_fd.read(chunk_size), ''):
+                char_historgram.update(chunk)
+            stage.add(symbols=sum(char_historgram.values()))
+        return dict(char_historgram)
+
+    def build_tree(self) -> None:
+        self.tree = CodeTree.from_histogram(self.char_historgram)
+        # if there is only one type of char in the file, its path is a single '0' bit
+        self.tree_codes = self.tree.leaf_codes()
 
     def assign_unique_values(self) -> None:
-        self.root.unique_value = UniqueValue(depth=0, path="")
-        # print(f"\nroot = {self.root}")
-        # if there is only one type of char in the file, make sure to convert it to '0' bits.
-        if self.root.is_leaf is True:
-            self.root.unique_value.path = "0"
-        # print("\n * Starting unique value assignments:")
-        self.root.assign_children_unique_values()
+        # leaves are named by their char, internal nodes get numbers counting up in preorder
+        self.unique_values = [None] * len(self.tree)
+        for node in self.tree.preorder():
+            self.unique_values[node] = self.tree.symbol(node) if self.tree.is_leaf(node) else str(UniqueValue.get_increase_count())
+
+    def legacy_orders(self) -> Tuple[str, str]:
+        # The Inorder/Preorder footer of the legacy text format. Only that format names the internal nodes,
+        # so they are numbered here instead of for every tree.
+        if self.unique_values is None:
+            self.assign_unique_values()
+        in_order_unique_values = ','.join([self.unique_values[node] for node in self.tree.inorder()])
+        pre_order_unique_values = ','.join([self.unique_values[node] for node in self.tree.preorder()])
+        return in_order_unique_values, pre_order_unique_values
+
+    def pack_tree(self) -> bytes:
+        # Compact binary form of the tree: preorder leaf/internal flags plus the leaf characters.
+        pre_order_nodes = self.tree.preorder()
+        shape = [1 if self.tree.is_leaf(node) else 0 for node in pre_order_nodes]
+        symbols = ''.join(self.tree.symbol(node) for node in pre_order_nodes if self.tree.is_leaf(node))
+        return pack_tree_table(shape, symbols)
+
+    def leaf_code_lengths(self) -> Dict[str, int]:
+        return {char: length for char, (code, length) in self.tree_codes.items()}
+
+    def canonical_paths(self) -> Dict[str, str]:
+        return {char: code_to_path(code, length) for char, (code, length) in canonical_codes(self.canonical_ordered).items()}
+
+    def symbol_count(self) -> int:
+        return sum(self.char_historgram.values())
+
+    def payload_bits(self, char2path: Dict[str, str]) -> int:
+        return sum(freq * len(char2path[char]) for char, freq in self.char_historgram.items())
 
 class Order:
     # Expects str_form to look as follows: "{a,b,c,2,3,...,h}" (which means even index characters are to be extracted)
@@ -169,63 +178,16 @@ class Order:
         self.build_list_form()
         
     def build_list_form(self, i: int= 0) -> None:
-        if not (i < len(self.xls_form)):
-            return
-        found_ind = self.xls_form.find(',', i+1)
-        if found_ind == -1:
-            print(f"build_list_form({i = }) can't find ','! exiting...")
-            exit(1)
-        self.list_form.append(self.xls_form[i : found_ind])
-        if(self.list_form[-1] == ""):
-            print(f"{self.list_form[-3] = }")
-            print(f"{self.list_form[-2] = }")
-            print(f"{self.list_form[-1] = }")
-            exit(1)
-        self.build_list_form(found_ind+1)
+        while i < len(self.xls_form):
+            # searching from i+1 lets a ',' character be a value of its own
+            found_ind = self.xls_form.find(',', i+1)
+            if found_ind == -1:
+                raise HuffmanError(f"build_list_form({i = }) can't find ','!")
+            self.list_form.append(self.xls_form[i : found_ind])
+            if(self.list_form[-1] == ""):
+                raise HuffmanError(f"empty value after {self.list_form[-3:-1]}")
+            i = found_ind+1
     
-class TreeNode:
-    def __init__(self, val: str, depth: int, path: str):
-        self.val: str = val
-        self.left: "TreeNode" = None
-        self.right: "TreeNode" = None
-        self.is_leaf = False
-        self.depth: int = depth
-        self.path: str = path
-
-    def __repr__(self) -> str:
-        return f"Preorder scan:\n{self}"
-
-    def __str__(self) -> str:
-        left = ""
-        right = ""
-        if self.left is not None:
-            left = f"\n{self.left}"
-        if self.right is not None:
-            right = f"\n{self.right}"
-        if self.val == '\n':
-            val = r'\n'
-        else:
-            val = self.val
-        return f"{self.depth * '-'}val: '{val}', {self.depth = }, {self.path = }{left}{right}"
-
-    @classmethod
-    def buildTree(cls, preorder: List[str], inorder: List[str], depth: int = 0, path: str = "") -> "TreeNode":
-        if not inorder or not preorder:
-            return None
-        # The first element in preorder is the root
-        root_value:str = preorder.pop(0)
-        root: TreeNode = TreeNode(root_value, depth, path)
-
-        # Find the index of the root in inorder list to split left and right subtrees
-        inorder_index: int = inorder.index(root_value)
-
-        # Recursively build the left and right subtrees
-        root.left = cls.buildTree(preorder, inorder[:inorder_index], depth + 1, path+'0')
-        root.right = cls.buildTree(preorder, inorder[inorder_index + 1:], depth + 1, path+'1')
-        if (root.left is None) and (root.right is None): 
-            root.is_leaf = True
-        return root
-
 class HuffmanEncoder:
     # ASCII Control Characters are: (0x00 to 0x1F, 0x7F)
     # apart from the ASCII control characters (0x00 to 0x1F and 0x7F), 
@@ -234,19 +196,60 @@ class HuffmanEncoder:
     control_characters: List[str] = [f"{bin(num)[2:]:>08}" for num in list(range(0x00, 0x1F+1)) + [0x7F]]
     backslash_code: str = f"{bin(0x5C)[2:]:>08}"
 
-    def __init__(self, hf_tree: HuffmanTree, compressed_file: str) -> None:
+    # "canonical" stores only the code length of every character, "tree" stores the tree shape.
+    code_tables: List[str] = ["canonical", "tree"]
+    # what read() returns at the end of the source, text here and bytes in ByteEncoder
+    end_of_source: str = ''
+
+    # With compressed_file=None nothing is written, the encoder is then driven through encode_stream().
+    # A block_size switches to block mode: blocks of block_size characters are encoded by `workers` processes.
+    # A seek_interval adds a seek index with a checkpoint every seek_interval characters (see read_range()).
+    # streams splits every block into that many interleaved bitstreams that decode independently (see FLAG_STREAMS),
+    # it switches to block mode with BLOCK_SIZE character blocks unless a block_size is given.
+    def __init__(self, hf_tree: HuffmanTree, compressed_file: str = None, legacy_text: bool = False, code_table: str = "canonical",
+                 block_size: int = None, workers: int = None, seek_interval: int = None, streams: int = None) -> None:
         self.hf_tree: HuffmanTree = hf_tree
         self.compressed_file:str = compressed_file
-        self.char2node_encoding_dict: Dict[str, HT_Node] = dict()   # created by: tree_to_encoding_dict()
+        # legacy_text writes the old escaped-text format with the Inorder/Preorder footer
+        self.legacy_text: bool = legacy_text
+        if streams is not None and (streams < 1 or legacy_text is True):
+            raise HuffmanError(f"streams = {streams} needs a positive count and can't be combined with legacy_text")
+        self.streams: int = streams
+        if streams is not None and block_size is None:
+            block_size = BLOCK_SIZE
+        self.block_size: int = block_size
+        self.workers: int = workers
+        if block_size is not None and seek_interval is not None:
+            raise HuffmanError("block mode already indexes every block, seek_interval can't be used with block_size or streams")
+        self.seek_interval: int = seek_interval
+        if code_table not in self.code_tables:
+            raise HuffmanError(f"unknown code table = {code_table}, expected one of {self.code_tables}")
+        # the legacy format always sends the tree, so its codes are the tree paths
+        self.code_table: str = "tree" if legacy_text is True else code_table
+        if legacy_text is True and len(hf_tree.tree) == 0:
+            raise HuffmanError("the legacy text format can't store an empty file")
+        if self.code_table == "tree" and hf_tree.length_limited is True:
+            raise HuffmanError(f"the tree is deeper than max_code_length = {hf_tree.max_code_length}, only the canonical code table can cap it")
         self.char2path_encoding_dict: Dict[str, str]                # created by: tree_to_encoding_dict()
-        self.buffer = ""
-        self.tree_to_encoding_dict()
+        self.char2code_encoding_dict: Dict[str, Tuple[int, int]]    # created by: tree_to_encoding_dict(), char -> (code, length)
+        self.buffer = ""        # bit string used by the legacy text writer
+        self.acc: int = 0       # integer bit accumulator used by encode_stream(), msb first
+        self.acc_bits: int = 0
+        with profile_stage("code dict"):
+            self.tree_to_encoding_dict()
         # print(f"\nencoding_dict = {self.char2path_encoding_dict}")
-        self.write2file()
+        if self.compressed_file is not None:
+            self.write2file()
 
     def tree_to_encoding_dict(self) -> None:
-        self.hf_tree.root.fill_encode_dict(self.char2node_encoding_dict)
-        self.char2path_encoding_dict = {char:node.unique_value.path for char, node in self.char2node_encoding_dict.items()}
+        if self.code_table == "canonical":
+            self.char2path_encoding_dict = self.hf_tree.canonical_paths()
+        else:
+            self.char2path_encoding_dict = {char:code_to_path(code, length) for char, (code, length) in self.hf_tree.tree_codes.items()}
+        self.char2code_encoding_dict = {char:(int(path, 2), len(path)) for char, path in self.char2path_encoding_dict.items()}
+
+    def symbol_count(self) -> int:
+        return self.hf_tree.symbol_count()
 
     @staticmethod
     def str_bin_2_char(str_bin: str) -> str:
@@ -261,13 +264,105 @@ class HuffmanEncoder:
         return "\\" + cls.str_bin_2_char('1' + str_bin[1:8])
     
     def write2file(self):
-        source_path = self.hf_tree.text_file_path
         # Check if the target file exists
         if not os.path.exists(self.compressed_file):
             # If it doesn't exist, create the file by opening it in write mode and then closing it
             open(file=self.compressed_file, mode='w', encoding='utf-8').close()
-            print(f"Created the file, ", end='')
-        
+        with profile_stage("encode") as stage:
+            if self.legacy_text is True:
+                self.write_text_file()
+                stage.add(**self.profile_counters())
+            else:
+                self.write_binary_file()
+            stage.add(bytes_in=os.path.getsize(self.hf_tree.text_file_path), bytes_out=os.path.getsize(self.compressed_file))
+
+    def profile_counters(self) -> Dict[str, int]:
+        # the symbols and payload bits of an encode, for the "encode" profiling stage
+        return dict(symbols=self.symbol_count(), bits=self.hf_tree.payload_bits(self.char2path_encoding_dict))
+
+    def write_binary_file(self) -> None:
+        # the source is read through a memory map (see huffman_mapped.py)
+        source_path = self.hf_tree.text_file_path
+        with open(file=self.compressed_file, mode='wb') as compressed_file, map_file(source_path) as source_view:
+            source_file = MappedSource(source_view)
+            if self.block_size is not None:
+                self.encode_blocks(source_file, compressed_file)
+            else:
+                self.encode_stream(source_file, compressed_file)
+
+    def container_header(self, flags: int = 0) -> ContainerHeader:
+        # The padding is known up front from the histogram, so the header can be written before the payload.
+        padding_bits = 0 if flags & FLAG_BLOCKS else -self.hf_tree.payload_bits(self.char2path_encoding_dict) % 8
+        if self.hf_tree.table_reused is True:
+            table_kind, table = TABLE_PREVIOUS, b""
+        elif self.code_table == "canonical":
+            table_kind, table = TABLE_CANONICAL, self.hf_tree.canonical_table
+        else:
+            table_kind, table = TABLE_TREE, self.hf_tree.pack_tree()
+        return ContainerHeader(table_kind=table_kind, original_length=self.hf_tree.symbol_count(),
+                               padding_bits=padding_bits, table=table, flags=flags, stream_count=self.streams or 1)
+
+    def encode_stream(self, source_fd: TextIO, compressed_fd: BinaryIO, chunk_size: int = CHUNK_SIZE) -> None:
+        # Writes the header and then the payload chunk by chunk, only one chunk of input and output is held at a time.
+        with profile_stage("encode") as stage:
+            self.encode_single_stream(source_fd, compressed_fd, chunk_size)
+            stage.add(**self.profile_counters())
+
+    def encode_single_stream(self, source_fd: TextIO, compressed_fd: BinaryIO, chunk_size: int) -> None:
+        flags = FLAG_SEEK_INDEX if self.seek_interval is not None else 0
+        compressed_fd.write(self.container_header(flags=flags).to_bytes())
+        seek_index: SeekIndex = None
+        if self.seek_interval is None:
+            for chunk in iter(lambda: source_fd.read(chunk_size), self.end_of_source):
+                compressed_fd.write(self.encode_chunk(chunk))
+        else:
+            seek_index = self.encode_indexed_chunks(source_fd, compressed_fd, chunk_size)
+        if self.acc_bits:
+            compressed_fd.write(bytes([self.acc << (8 - self.acc_bits)]))
+            self.acc, self.acc_bits = 0, 0
+        if seek_index is not None:
+            seek_index.write_with_footer(compressed_fd)
+
+    def encode_indexed_chunks(self, source_fd: TextIO, compressed_fd: BinaryIO, chunk_size: int) -> SeekIndex:
+        # Chunks are cut at every multiple of seek_interval so the bit offset of each checkpoint is known exactly.
+        seek_index = SeekIndex(self.seek_interval)
+        payload_bytes: int = 0
+        position: int = 0
+        while True:
+            if position % self.seek_interval == 0:
+                seek_index.append(8 * payload_bytes + self.acc_bits)
+            chunk = source_fd.read(min(chunk_size, self.seek_interval - position % self.seek_interval))
+            if not chunk:
+                return seek_index
+            payload = self.encode_chunk(chunk)
+            compressed_fd.write(payload)
+            payload_bytes += len(payload)
+            position += len(chunk)
+
+    def encode_chunk(self, chunk: str) -> bytearray:
+        payload, self.acc, self.acc_bits = pack_codes(chunk, self.char2code_encoding_dict, self.acc, self.acc_bits)
+        return payload
+
+    def encode_blocks(self, source_fd: TextIO, compressed_fd: BinaryIO) -> BlockIndex:
+        # Every block is encoded on its own with the shared code table, so blocks can be encoded (and later
+        # decoded) in parallel. Blocks are written in order as they complete, followed by the block index.
+        # With streams every block is its interleaved streams one after the other, each with its own index entry.
+        with profile_stage("encode") as stage:
+            flags = FLAG_BLOCKS | FLAG_STREAMS if self.streams is not None else FLAG_BLOCKS
+            compressed_fd.write(self.container_header(flags=flags).to_bytes())
+            block_index = BlockIndex()
+            blocks = iter(lambda: source_fd.read(self.block_size), self.end_of_source)
+            for payload, streams in ordered_map(encode_block, blocks, workers=self.workers, initializer=init_block_worker,
+                                                initargs=(self.char2code_encoding_dict, self.streams or 1)):
+                compressed_fd.write(payload)
+                for symbol_count, bit_length in streams:
+                    block_index.append(symbol_count, bit_length)
+            block_index.write_with_footer(compressed_fd)
+            stage.add(**self.profile_counters())
+        return block_index
+
+    def write_text_file(self) -> None:
+        source_path = self.hf_tree.text_file_path
         # If it exists, open the target file in write mode and the source file in read mode
         with open(file=self.compressed_file, mode='w', encoding='utf-8') as compressed_file, open(file=source_path, mode='r', encoding='utf-8') as source_file:
             # Move lines from the source file to the target file
@@ -282,37 +377,371 @@ class HuffmanEncoder:
             tmp = self.str_bin_encoder(f"{self.buffer:<08}")
             compressed_file.write(tmp)
             compressed_file.write(str(left_over_len_in_buffer))
-            compressed_file.write(f"\nInorder={{{self.hf_tree.in_order_unique_values}}}")
-            compressed_file.write(f"\nPreorder={{{self.hf_tree.pre_order_unique_values}}}")
+            in_order_unique_values, pre_order_unique_values = self.hf_tree.legacy_orders()
+            compressed_file.write(f"\nInorder={{{in_order_unique_values}}}")
+            compressed_file.write(f"\nPreorder={{{pre_order_unique_values}}}")
+
+class ByteEncoder(HuffmanEncoder):
+    # Byte symbol mode: the alphabet is the 256 byte values, so any file (binary, or text in any encoding) round trips
+    # byte for byte. byte_counts and the code table are lists indexed by byte value and the source is read as bytes.
+    # The tree is still built by HuffmanTree, over the characters chr(0)..chr(255), whose canonical order is the byte order.
+    end_of_source: bytes = b''
+
+    def __init__(self, byte_counts: List[int], source_path: str = None, compressed_file: str = None, block_size: int = None,
+                 workers: int = None, seek_interval: int = None, max_code_length: int = None, streams: int = None,
+                 previous_ordered: List[Tuple[str, int]] = None) -> None:
+        self.byte_counts: List[int] = byte_counts
+        hf_tree = HuffmanTree(text_file_path=source_path, char_historgram={chr(byte): count for byte, count in enumerate(byte_counts) if count},
+                              max_code_length=max_code_length, previous_ordered=previous_ordered)
+        self.byte_ordered: List[Tuple[int, int]] = [(ord(char), length) for char, length in hf_tree.canonical_ordered]
+        super().__init__(hf_tree=hf_tree, compressed_file=compressed_file, block_size=block_size, workers=workers, seek_interval=seek_interval,
+                         streams=streams)
+
+    @staticmethod
+    def stream_byte_counts(source_fd: BinaryIO, chunk_size: int = CHUNK_SIZE) -> List[int]:
+        byte_counts: List[int] = [0] * 256
+        with profile_stage("histogram") as stage:
+            for chunk in iter(lambda: source_fd.read(chunk_size), b''):
+                for byte, count in enumerate(count_bytes(chunk)):
+                    byte_counts[byte] += count
+            stage.add(symbols=sum(byte_counts))
+        return byte_counts
+
+    def tree_to_encoding_dict(self) -> None:
+        super().tree_to_encoding_dict()
+        # pack_codes() looks codes up by the items of the chunk, which are ints for bytes
+        codes: List[Tuple[int, int]] = [None] * 256
+        for char, code in self.char2code_encoding_dict.items():
+            codes[ord(char)] = code
+        self.char2code_encoding_dict = codes
+
+    def symbol_count(self) -> int:
+        return sum(self.byte_counts)
+
+    def container_header(self, flags: int = 0) -> ContainerHeader:
+        padding_bits = 0 if flags & FLAG_BLOCKS else -sum(count * self.char2code_encoding_dict[byte][1]
+                                                           for byte, count in enumerate(self.byte_counts) if count) % 8
+        table_kind, table = (TABLE_PREVIOUS, b"") if self.hf_tree.table_reused is True else (TABLE_BYTES, pack_byte_table(self.byte_ordered))
+        return ContainerHeader(table_kind=table_kind, original_length=self.symbol_count(), padding_bits=padding_bits, table=table, flags=flags,
+                               stream_count=self.streams or 1)
+
+    def write_binary_file(self) -> None:
+        if self.block_size is not None:
+            # blocks are copied to the worker processes anyway, views of the mapping can't be sent to them
+            with open(file=self.compressed_file, mode='wb') as compressed_file, open(file=self.hf_tree.text_file_path, mode='rb') as source_file:
+                self.encode_blocks(source_file, compressed_file)
+            return
+        # encodes straight from memoryview slices of the mapped source, pack_codes() reads the bytes in place
+        with open(file=self.compressed_file, mode='wb') as compressed_file, map_file(self.hf_tree.text_file_path) as source_view:
+            self.encode_stream(MappedSource(source_view, text=False), compressed_file)
 
 class Huffman:
-    def __init__(self, text_file_path: str) -> None:
+    # Command line front end over compress_file(), prints the result. Without compressed_file_path
+    # the output goes next to this script.
+    # text_file_path "-" reads stdin, which can only be read once, so it needs code_table="adaptive".
+    # append adds the text file to the end of compressed_file_path as a new segment (see append_file()).
+    def __init__(self, text_file_path: str, legacy_text: bool = False, block_size: int = None, seek_interval: int = None,
+                 compressed_file_path: str = None, code_table: str = "canonical", max_code_length: int = None, byte_symbols: bool = False,
+                 streams: int = None, append: bool = False) -> None:
         ID1:str = "209323658"
         ID2:str = "315932608"
         self.text_file_path: str = text_file_path
-        self.compressed_file_path: str = self.get_file_path(file_name=f"{ID1}_{ID2}_compressed.txt")
-        self.huffman_tree: HuffmanTree = HuffmanTree(text_file_path=text_file_path)
-        self.huffman_encoder: HuffmanEncoder = HuffmanEncoder(hf_tree=self.huffman_tree, compressed_file=self.compressed_file_path)
+        extension: str = "txt" if legacy_text is True else "bin"
+        if compressed_file_path is None:
+            compressed_file_path = self.get_file_path(file_name=f"{ID1}_{ID2}_compressed.{extension}")
+        self.compressed_file_path: str = compressed_file_path
+        if text_file_path == "-":
+            if code_table != ADAPTIVE:
+                raise HuffmanError("stdin can only be read once, compressing it needs --adaptive")
+            with open(file=compressed_file_path, mode='wb') as compressed_fd:
+                self.huffman_encoder: AdaptiveEncoder = compress_adaptive(io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8'), compressed_fd)
+        elif append is True:
+            if legacy_text is True or block_size is not None or seek_interval is not None or code_table != "canonical" or streams is not None:
+                raise HuffmanError("an appended segment is a plain stream, append can't be combined with legacy_text, blocks, a seek index, "
+                                   "adaptive mode or streams")
+            self.huffman_encoder: HuffmanEncoder = append_file(text_file_path, compressed_file_path, max_code_length=max_code_length,
+                                                               byte_symbols=byte_symbols)
+        else:
+            self.huffman_encoder: HuffmanEncoder = compress_file(text_file_path, compressed_file_path, legacy_text=legacy_text, code_table=code_table,
+                                                                 block_size=block_size, seek_interval=seek_interval, max_code_length=max_code_length,
+                                                                 byte_symbols=byte_symbols, streams=streams)
         print(f"Compressed file path: {self.compressed_file_path}")
         print()
-        with open(file=self.text_file_path, mode='r', encoding='utf-8') as fd:
-            content = fd.read()
-            print(f"Original file len = {len(content)}")
-        with open(file=self.compressed_file_path, mode='r', encoding='utf-8') as fd:
-            for line in fd:
-                print(f"Compressed file - compressed text len = {len(line)}")
-                break
-        with open(file=self.compressed_file_path, mode='r', encoding='utf-8') as fd:
-            content = fd.read()
-            print(f"Compressed file len = {len(content)}")
+        print(f"Original file len = {self.huffman_encoder.symbol_count()}")
+        if text_file_path != "-":
+            print(f"Original file size = {os.path.getsize(self.text_file_path)} bytes")
+        print(f"Compressed file size = {os.path.getsize(self.compressed_file_path)} bytes")
 
     @staticmethod
     def get_file_path(file_name: str) -> str:
         return os.path.join(os.path.dirname(os.path.abspath(__file__)), file_name)
 
+def pack_codes(chunk: str, codes: Dict[str, Tuple[int, int]], acc: int, acc_bits: int) -> Tuple[bytearray, int, int]:
+    # Shifts every code into the integer accumulator and flushes whole bytes once FLUSH_BITS are pending.
+    # For bytes chunks, codes is the list indexed by byte value (see ByteEncoder).
+    # Returns the whole bytes and the leftover accumulator (fewer than 8 bits) to carry into the next chunk.
+    payload = bytearray()
+    for char in chunk:
+        code, length = codes[char]
+        acc = (acc << length) | code
+        acc_bits += length
+        if acc_bits >= FLUSH_BITS:
+            acc, acc_bits = flush_bytes(payload, acc, acc_bits)
+    acc, acc_bits = flush_bytes(payload, acc, acc_bits)
+    return payload, acc, acc_bits
+
+# Code table and streams per block of a block worker process, set once by init_block_worker() instead of being sent with every block.
+block_worker_codes: Dict[str, Tuple[int, int]] = None
+block_worker_streams: int = 1
+
+def init_block_worker(codes: Dict[str, Tuple[int, int]], streams: int = 1) -> None:
+    global block_worker_codes, block_worker_streams
+    block_worker_codes = codes
+    block_worker_streams = streams
+
+def encode_block(block: str) -> Tuple[bytes, List[Tuple[int, int]]]:
+    # Returns the payload of one block and the (symbol count, bit length) of each of its byte aligned streams,
+    # symbol i of the block goes to stream i % streams.
+    count = block_worker_streams
+    payload = bytearray()
+    streams: List[Tuple[int, int]] = list()
+    for stream in range(count):
+        part = block[stream::count] if count > 1 else block
+        packed, acc, acc_bits = pack_codes(part, block_worker_codes, 0, 0)
+        streams.append((len(part), 8 * len(packed) + acc_bits))
+        if acc_bits:
+            packed.append(acc << (8 - acc_bits))
+        payload += packed
+    return bytes(payload), streams
+
+def compress_file(text_file_path: str, compressed_file_path: str, legacy_text: bool = False, code_table: str = "canonical",
+                  block_size: int = None, workers: int = None, seek_interval: int = None, max_code_length: int = None,
+                  byte_symbols: bool = False, streams: int = None) -> HuffmanEncoder:
+    # Compresses the text file into compressed_file_path without printing, returns the encoder that wrote it
+    # (an AdaptiveEncoder for code_table="adaptive", a ContextEncoder for "context"). byte_symbols compresses any file as bytes (see ByteEncoder).
+    if not os.path.isfile(text_file_path):
+        raise HuffmanError(f"text file path is wrong = {text_file_path}")
+    if byte_symbols is True:
+        if legacy_text is True or code_table != "canonical":
+            raise HuffmanError("byte symbols always use the canonical byte table, they can't be combined with legacy_text or another code_table")
+        return ByteEncoder(byte_histogram(text_file_path, workers=workers), source_path=text_file_path, compressed_file=compressed_file_path,
+                           block_size=block_size, workers=workers, seek_interval=seek_interval, max_code_length=max_code_length, streams=streams)
+    if code_table == ADAPTIVE:
+        if legacy_text is True or block_size is not None or seek_interval is not None or streams is not None:
+            raise HuffmanError("adaptive mode is a single stream, it can't be combined with legacy_text, block_size, seek_interval or streams")
+        with open(file=text_file_path, mode='r', encoding='utf-8') as source_fd, open(file=compressed_file_path, mode='wb') as compressed_fd:
+            return compress_adaptive(source_fd, compressed_fd)
+    if code_table == CONTEXT:
+        if legacy_text is True or block_size is not None or seek_interval is not None or streams is not None:
+            raise HuffmanError("context mode is a single stream, it can't be combined with legacy_text, block_size, seek_interval or streams")
+        with open(file=text_file_path, mode='r', encoding='utf-8') as source_fd, open(file=compressed_file_path, mode='wb') as compressed_fd:
+            return compress_context(source_fd, compressed_fd, max_code_length=max_code_length)
+    hf_tree = HuffmanTree(text_file_path=text_file_path, histogram_workers=workers, max_code_length=max_code_length)
+    return HuffmanEncoder(hf_tree=hf_tree, compressed_file=compressed_file_path, legacy_text=legacy_text, code_table=code_table,
+                          block_size=block_size, workers=workers, seek_interval=seek_interval, streams=streams)
+
+def append_file(text_file_path: str, compressed_file_path: str, workers: int = None, max_code_length: int = None,
+                byte_symbols: bool = False) -> HuffmanEncoder:
+    # Appends the text file to the compressed file as a new segment (see FLAG_SEGMENTS) without decoding what's already there,
+    # only the new data is read and encoded, plus the headers and the segment index. The segment reuses the canonical table of
+    # the segment before it when HuffmanTree.reuse_table() allows, otherwise it stores a table of its own.
+    # Segments keep the symbols of the first one: bytes after byte_symbols, which only matters when the compressed file
+    # doesn't exist yet and is created by compress_file().
+    # The text file is mapped once and both passes read that mapping, so a log that grows meanwhile is appended up to
+    # where it was mapped. The segment is encoded into a temporary file first, the compressed file is only changed
+    # once it's complete, and its old segment index is written back if that change fails.
+    if not os.path.isfile(text_file_path):
+        raise HuffmanError(f"text file path is wrong = {text_file_path}")
+    if not os.path.isfile(compressed_file_path):
+        return compress_file(text_file_path, compressed_file_path, workers=workers, max_code_length=max_code_length, byte_symbols=byte_symbols)
+    with open(file=compressed_file_path, mode='r+b') as compressed_fd:
+        first_header = ContainerHeader.from_fd(compressed_fd)
+        if first_header.version < 2:
+            raise HuffmanError(f"container version = {first_header.version} has no flags, it can't be appended to")
+        if byte_symbols is True and first_header.table_kind != TABLE_BYTES:
+            raise HuffmanError("the compressed file holds text, byte symbols can't be appended to it")
+        if first_header.flags & FLAG_SEGMENTS:
+            segment_index, end = SegmentIndex.read(compressed_fd)
+        else:
+            segment_index, end = SegmentIndex([0]), compressed_fd.seek(0, 2)
+        previous_ordered = previous_code_table(compressed_fd, segment_index)
+        text = first_header.table_kind != TABLE_BYTES
+        with map_file(text_file_path) as source_view, tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(compressed_file_path))) as segment_fd:
+            if text is True:
+                hf_tree = HuffmanTree(text_file_path=text_file_path, char_historgram=HuffmanTree.stream_histogram(MappedSource(source_view)),
+                                      max_code_length=max_code_length, previous_ordered=previous_ordered)
+                encoder = HuffmanEncoder(hf_tree=hf_tree)
+            else:
+                encoder = ByteEncoder(ByteEncoder.stream_byte_counts(MappedSource(source_view, text=False)), source_path=text_file_path,
+                                      max_code_length=max_code_length, previous_ordered=previous_ordered)
+            if encoder.symbol_count() == 0:
+                return encoder
+            encoder.encode_stream(MappedSource(source_view, text=text), segment_fd)
+            # the new segment overwrites the old segment index, a new one follows it
+            compressed_fd.seek(end)
+            old_index = compressed_fd.read()
+            try:
+                compressed_fd.seek(end)
+                segment_fd.seek(0)
+                shutil.copyfileobj(segment_fd, compressed_fd)
+                segment_index.append(end)
+                segment_index.write_with_footer(compressed_fd)
+                compressed_fd.truncate()
+                if not first_header.flags & FLAG_SEGMENTS:
+                    compressed_fd.seek(FLAGS_OFFSET)
+                    compressed_fd.write(bytes([first_header.flags | FLAG_SEGMENTS]))
+            except BaseException:
+                compressed_fd.seek(end)
+                compressed_fd.write(old_index)
+                compressed_fd.truncate()
+                raise
+    return encoder
+
+
+def previous_code_table(compressed_fd: BinaryIO, segment_index: SegmentIndex) -> List[Tuple[str, int]]:
+    # The canonical table the last segment is encoded with, following TABLE_PREVIOUS back. None when it's another kind
+    # of table (tree, model or adaptive), a new segment then always stores its own.
+    for offset in reversed(segment_index.offsets):
+        compressed_fd.seek(offset)
+        header = ContainerHeader.from_fd(compressed_fd)
+        if header.table_kind == TABLE_PREVIOUS:
+            continue
+        if header.table_kind == TABLE_CANONICAL:
+            return unpack_canonical_table(header.table)
+        if header.table_kind == TABLE_BYTES:
+            return [(chr(byte), length) for byte, length in unpack_byte_table(header.table)]
+        return None
+    return None
+
+def compress_stream(src: TextIO, dst: BinaryIO, chunk_size: int = CHUNK_SIZE, code_table: str = "canonical", seek_interval: int = None,
+                    max_code_length: int = None, byte_symbols: bool = False) -> None:
+    # Compresses the text stream src into the binary stream dst with memory bounded by chunk_size.
+    # src is read twice (histogram, then encoding) so it must be seekable, except with code_table="adaptive".
+    # With byte_symbols src is a binary stream.
+    if byte_symbols is True:
+        if code_table != "canonical":
+            raise HuffmanError("byte symbols always use the canonical byte table")
+        if not src.seekable():
+            raise HuffmanError("compress_stream() needs a seekable source")
+        start = src.tell()
+        byte_counts = ByteEncoder.stream_byte_counts(src, chunk_size)
+        src.seek(start)
+        ByteEncoder(byte_counts, seek_interval=seek_interval, max_code_length=max_code_length).encode_stream(src, dst, chunk_size)
+        return
+    if code_table == ADAPTIVE:
+        if seek_interval is not None:
+            raise HuffmanError("adaptive mode can't have a seek index")
+        compress_adaptive(src, dst, chunk_size)
+        return
+    if code_table == CONTEXT:
+        if seek_interval is not None:
+            raise HuffmanError("context mode can't have a seek index")
+        compress_context(src, dst, chunk_size, max_code_length)
+        return
+    if not src.seekable():
+        raise HuffmanError("compress_stream() needs a seekable source")
+    start = src.tell()
+    char_historgram = HuffmanTree.stream_histogram(src, chunk_size)
+    src.seek(start)
+    hf_tree = HuffmanTree(char_historgram=char_historgram, max_code_length=max_code_length)
+    HuffmanEncoder(hf_tree=hf_tree, code_table=code_table, seek_interval=seek_interval).encode_stream(src, dst, chunk_size)
+
+def train_model(sample_paths: List[str], base_alphabet: str = MODEL_BASE_ALPHABET, max_code_length: int = None) -> HuffmanModel:
+    # Builds a code table from the character counts of the sample files, plus one count for every base_alphabet character.
+    char_historgram: Counter = Counter()
+    for sample_path in sample_paths:
+        char_historgram.update(char_histogram(sample_path))
+    char_historgram.update(base_alphabet)
+    return HuffmanModel(HuffmanTree(char_historgram=char_historgram, max_code_length=max_code_length).canonical_ordered)
+
+def compress_message(text: str, model: HuffmanModel) -> bytes:
+    # Compresses one in-memory message against a trained model, the header then holds only the model id.
+    # A message with characters the model has no code for carries its own canonical table instead.
+    return compress_text(text, model=model)
+
+def compress_text(text: str, code_table: str = "canonical", model: HuffmanModel = None, flags: int = 0, max_code_length: int = None) -> bytes:
+    # Compresses an in-memory text into a complete container, with its own table or against `model` when it covers the text.
+    with profile_stage("encode") as stage:
+        if code_table == ADAPTIVE and (model is None or not model.covers(text)):
+            encoder = AdaptiveEncoder()
+            header = adaptive_header()
+            header.flags = flags
+            blob = header.to_bytes() + encoder.encode(text) + encoder.finish()
+            stage.add(symbols=len(text), bytes_out=len(blob))
+            return blob
+        if code_table == CONTEXT and (model is None or not model.covers(text)):
+            blob = compress_context_text(text, flags=flags, max_code_length=max_code_length)
+            stage.add(symbols=len(text), bytes_out=len(blob))
+            return blob
+        if model is not None and model.covers(text):
+            codes, table_kind, table = model.codes, TABLE_MODEL, model.model_id
+        else:
+            encoder = HuffmanEncoder(hf_tree=HuffmanTree(char_historgram=Counter(text), max_code_length=max_code_length), code_table=code_table)
+            header = encoder.container_header()
+            codes, table_kind, table = encoder.char2code_encoding_dict, header.table_kind, header.table
+        payload, acc, acc_bits = pack_codes(text, codes, 0, 0)
+        padding_bits = 0
+        if acc_bits:
+            payload.append(acc << (8 - acc_bits))
+            padding_bits = 8 - acc_bits
+        header = ContainerHeader(table_kind=table_kind, original_length=len(text), padding_bits=padding_bits, table=table, flags=flags)
+        blob = header.to_bytes() + payload
+        stage.add(symbols=len(text), bits=8 * len(payload) - padding_bits, bytes_out=len(blob))
+    return blob
+
+def compress_bytes(data: bytes, flags: int = 0, max_code_length: int = None) -> bytes:
+    # Compresses in-memory bytes into a complete container with a byte table (see ByteEncoder).
+    with profile_stage("encode") as stage:
+        encoder = ByteEncoder(count_bytes(data), max_code_length=max_code_length)
+        payload, acc, acc_bits = pack_codes(memoryview(data).cast('B'), encoder.char2code_encoding_dict, 0, 0)
+        if acc_bits:
+            payload.append(acc << (8 - acc_bits))
+        blob = encoder.container_header(flags=flags).to_bytes() + payload
+        stage.add(bytes_in=encoder.symbol_count(), symbols=encoder.symbol_count(), bits=8 * len(payload) - (-acc_bits % 8), bytes_out=len(blob))
+    return blob
+
 def main() -> None:
     first_argument: str = get_first_arg()
-    Huffman(text_file_path=first_argument)
+    legacy_text: bool = "--legacy-text" in sys.argv[2:]
+    # --blocks encodes BLOCK_SIZE character blocks in parallel on all cores
+    block_size: int = BLOCK_SIZE if "--blocks" in sys.argv[2:] else None
+    # --seek-index adds a checkpoint every SEEK_INTERVAL characters for read_range()
+    seek_interval: int = SEEK_INTERVAL if "--seek-index" in sys.argv[2:] else None
+    # --adaptive compresses in a single pass without a code table, a first argument of "-" reads stdin
+    code_table: str = ADAPTIVE if "--adaptive" in sys.argv[2:] else "canonical"
+    # --context codes every character with a table chosen by the character before it
+    if "--context" in sys.argv[2:]:
+        code_table = CONTEXT
+    # --bytes compresses any file byte for byte instead of as UTF-8 text
+    byte_symbols: bool = "--bytes" in sys.argv[2:]
+    # --max-code-length=N caps every code at N bits
+    max_code_length: int = None
+    # --streams splits every block into STREAMS interleaved streams, --streams=K into K, with BLOCK_SIZE blocks unless --blocks is given
+    streams: int = STREAMS if "--streams" in sys.argv[2:] else None
+    # --append adds the file to the end of the compressed file as a new segment
+    append: bool = "--append" in sys.argv[2:]
+    # --profile prints the time and counters of every stage as JSON to stderr, --profile=path writes them to a file
+    profile: bool = "--profile" in sys.argv[2:]
+    profile_path: str = None
+    # an optional second argument is the compressed file path
+    compressed_file_path: str = sys.argv[2] if len(sys.argv) > 2 and not sys.argv[2].startswith("--") else None
+    try:
+        for arg in sys.argv[2:]:
+            if arg.startswith("--max-code-length="):
+                max_code_length = check_max_code_length(parse_int_option(arg))
+            if arg.startswith("--streams="):
+                streams = parse_int_option(arg)
+            if arg.startswith("--profile="):
+                profile, profile_path = True, arg.split("=", 1)[1]
+        with profiling() if profile is True else nullcontext() as profiler:
+            Huffman(text_file_path=first_argument, legacy_text=legacy_text, block_size=block_size, seek_interval=seek_interval,
+                    compressed_file_path=compressed_file_path, code_table=code_table, max_code_length=max_code_length, byte_symbols=byte_symbols,
+                    streams=streams, append=append)
+        if profiler is not None:
+            write_profile(profiler, profile_path)
+    except (HuffmanError, OSError) as e:
+        print(f"{e}, exiting...")
+        exit(1)
 
 def get_first_arg() -> str:
     if len(sys.argv) > 1:
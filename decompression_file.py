@@ -1,7 +1,26 @@
-from typing import List, Dict
+from typing import List, Dict, Tuple, Iterator, Union, TextIO, BinaryIO
+from array import array
+from contextlib import nullcontext
+import io
 import sys
 import os
 
+from huffman_format import HuffmanError, ContainerHeader, CHUNK_SIZE, BlockIndex, SeekIndex, SegmentIndex, SegmentFile, TABLE_TREE, TABLE_CANONICAL, TABLE_MODEL, TABLE_ADAPTIVE, TABLE_BYTES, TABLE_PREVIOUS, TABLE_CONTEXT, FLAG_BLOCKS, FLAG_SEEK_INDEX, FLAG_SEGMENTS, read_footer, corrupt_data_errors, unpack_tree_table, unpack_canonical_table, unpack_byte_table
+from huffman_codes import canonical_codes, code_to_path
+from huffman_parallel import ordered_map
+from huffman_model import HuffmanModel
+from huffman_adaptive import AdaptiveDecoder, decompress_adaptive
+from huffman_context import ContextModel, START_CONTEXT
+from huffman_mapped import map_file, MappedWriter
+from huffman_tree import CodeTree, NO_NODE
+from huffman_profile import profile_stage, profiling, write_profile
+
+# Byte symbol containers (TABLE_BYTES) are decoded as the characters chr(0)..chr(255), which this encoding
+# turns back into the original bytes one to one. Written without newline translation.
+BYTE_SYMBOL_ENCODING: str = 'latin-1'
+# A table of table_bits bits per lookup has 2**table_bits entries per state.
+MAX_TABLE_BITS: int = 16
+
 class Order:
     # Expects str_form to look as follows: "{a,b,c,2,3,...,h}" (which means even index characters are to be extracted)
     def __init__(self, str_form: str) -> None:
@@ -11,118 +30,364 @@ class Order:
         self.build_list_form()
         
     def build_list_form(self, i: int= 0) -> None:
-        if not (i < len(self.xls_form)):
-            return
-        found_ind = self.xls_form.find(',', i+1)
-        if found_ind == -1:
-            print(f"build_list_form({i = }) can't find ','! exiting...")
-            exit(1)
-        self.list_form.append(self.xls_form[i : found_ind])
-        if(self.list_form[-1] == ""):
-            print(f"{self.list_form[-3] = }")
-            print(f"{self.list_form[-2] = }")
-            print(f"{self.list_form[-1] = }")
-            exit(1)
-        self.build_list_form(found_ind+1)
+        while i < len(self.xls_form):
+            # searching from i+1 lets a ',' character be a value of its own
+            found_ind = self.xls_form.find(',', i+1)
+            if found_ind == -1:
+                raise HuffmanError(f"build_list_form({i = }) can't find ','!")
+            self.list_form.append(self.xls_form[i : found_ind])
+            if(self.list_form[-1] == ""):
+                raise HuffmanError(f"empty value after {self.list_form[-3:-1]}")
+            i = found_ind+1
     
-class TreeNode:
-    def __init__(self, val: str, depth: int, path: str):
-        self.val: str = val
-        self.left: "TreeNode" = None
-        self.right: "TreeNode" = None
-        self.is_leaf = False
-        self.depth: int = depth
-        self.path: str = path
-
-    def __repr__(self) -> str:
-        return f"Preorder scan:\n{self}"
-
-    def __str__(self) -> str:
-        left = ""
-        right = ""
-        if self.left is not None:
-            left = f"\n{self.left}"
-        if self.right is not None:
-            right = f"\n{self.right}"
-        if self.val == '\n':
-            val = r'\n'
+def tree_from_header(header: ContainerHeader, model_store: "ModelStore" = None) -> CodeTree:
+    with profile_stage("tree") as stage:
+        if header.table_kind == TABLE_CANONICAL:
+            tree = CodeTree.from_codes(canonical_codes(unpack_canonical_table(header.table)))
+        elif header.table_kind == TABLE_BYTES:
+            tree = CodeTree.from_codes(canonical_codes([(chr(byte), length) for byte, length in unpack_byte_table(header.table)]))
+        elif header.table_kind == TABLE_MODEL:
+            if model_store is None:
+                raise HuffmanError(f"compressed with model {header.table.hex()}, a ModelStore is needed to decode it")
+            tree = CodeTree.from_codes(canonical_codes(model_store.model(header.table).ordered))
+        elif header.table_kind == TABLE_TREE:
+            tree = CodeTree.from_shape(*unpack_tree_table(header.table))
         else:
-            val = self.val
-        return f"{self.depth * '-'}val: '{val}', {self.depth = }, {self.path = }{left}{right}"
+            raise HuffmanError(f"unsupported code table kind = {header.table_kind}")
+        stage.add(nodes=len(tree))
+    return tree
 
-    @classmethod
-    def buildTree(cls, preorder: List[str], inorder: List[str], depth: int = 0, path: str = "") -> "TreeNode":
-        if not inorder or not preorder:
-            return None
-        # The first element in preorder is the root
-        root_value:str = preorder.pop(0)
-        root: TreeNode = TreeNode(root_value, depth, path)
-
-        # Find the index of the root in inorder list to split left and right subtrees
-        inorder_index: int = inorder.index(root_value)
-
-        # Recursively build the left and right subtrees
-        root.left = cls.buildTree(preorder, inorder[:inorder_index], depth + 1, path+'0')
-        root.right = cls.buildTree(preorder, inorder[inorder_index + 1:], depth + 1, path+'1')
-        if (root.left is None) and (root.right is None): 
-            root.is_leaf = True
-        return root
+def check_table_bits(table_bits: int) -> int:
+    if not 1 <= table_bits <= MAX_TABLE_BITS:
+        raise HuffmanError(f"table_bits = {table_bits}, expected 1..{MAX_TABLE_BITS}")
+    return table_bits
+
+class DecodeTable:
+    # State machine that decodes `table_bits` bits per lookup instead of one bit per tree step.
+    # Every internal node of the tree is a state (the root is state 0). The entry for (state, k bits)
+    # holds the symbols emitted while walking those k bits from that state and the state the walk ends in.
+    def __init__(self, tree: CodeTree, table_bits: int = 8) -> None:
+        self.tree: CodeTree = tree
+        self.table_bits: int = check_table_bits(table_bits)
+        self.states: List[int] = list()                         # created by: build_states(), the node of every state
+        self.state_index: array = array('i')                    # created by: build_states(), the state of every internal node
+        self.bit_entries: List[Tuple[str, int]] = list()        # created by: build_bit_entries()
+        self.entries: List[Tuple[str, int]] = list()            # created by: build_entries()
+        with profile_stage("decode table") as stage:
+            self.build_states()
+            self.build_bit_entries()
+            self.build_entries()
+            stage.add(states=len(self.states), entries=len(self.entries))
+        self.reset()
+
+    def build_states(self) -> None:
+        # An empty tree (empty input) or a single-leaf tree has no internal nodes, its root is the only state.
+        tree = self.tree
+        if len(tree) == 0 or tree.is_leaf(tree.root):
+            self.states.append(tree.root)
+            return
+        self.state_index = array('i', [NO_NODE]) * len(tree)
+        for node in tree.preorder():
+            if not tree.is_leaf(node):
+                self.state_index[node] = len(self.states)
+                self.states.append(node)
+
+    def step(self, state: int, bit: int) -> Tuple[str, int]:
+        tree = self.tree
+        node = self.states[state]
+        if node == NO_NODE:         # empty tree, there is nothing to decode
+            return "", 0
+        if tree.is_leaf(node):      # single-leaf tree, every bit is the one symbol
+            return tree.symbol(node), 0
+        node = tree.right[node] if bit else tree.left[node]
+        if tree.is_leaf(node):
+            return tree.symbol(node), 0
+        return "", self.state_index[node]
+
+    def build_bit_entries(self) -> None:
+        # entry index is (state << 1) | bit
+        self.bit_entries = [self.step(state, bit) for state in range(len(self.states)) for bit in (0, 1)]
+
+    def build_entries(self) -> None:
+        # Grow the table one bit at a time: the entry for value v of j+1 bits is the entry for
+        # v >> 1 (j bits) followed by a single step on the lowest bit of v.
+        entries: List[Tuple[str, int]] = [("", state) for state in range(len(self.states))]
+        for width in range(self.table_bits):
+            next_entries: List[Tuple[str, int]] = list()
+            for state in range(len(self.states)):
+                base = state << width
+                for value in range(1 << (width + 1)):
+                    out, mid_state = entries[base | (value >> 1)]
+                    more, end_state = self.bit_entries[(mid_state << 1) | (value & 1)]
+                    next_entries.append((out + more, end_state))
+            entries = next_entries
+        self.entries = entries
+
+    def reset(self) -> None:
+        # streaming state carried between feed() calls
+        self.state: int = 0
+        self.acc: int = 0
+        self.acc_bits: int = 0
+
+    def feed(self, data: bytes) -> str:
+        # Decodes whole bytes of the stream, bits that don't fill a table lookup are kept for the next call.
+        k: int = self.table_bits
+        mask: int = (1 << k) - 1
+        entries = self.entries
+        chunks: List[str] = list()
+        state, acc, acc_bits = self.state, self.acc, self.acc_bits
+        for byte in data:
+            acc = (acc << 8) | byte
+            acc_bits += 8
+            while acc_bits >= k:
+                acc_bits -= k
+                out, state = entries[(state << k) | ((acc >> acc_bits) & mask)]
+                if out:
+                    chunks.append(out)
+            acc &= (1 << acc_bits) - 1
+        self.state, self.acc, self.acc_bits = state, acc, acc_bits
+        return ''.join(chunks)
+
+    def finish(self, tail: int, tail_bits: int) -> str:
+        # The leftover bits plus the last `tail_bits` bits of the stream (right aligned in tail) are walked one bit at a time.
+        acc = (self.acc << tail_bits) | tail
+        acc_bits = self.acc_bits + tail_bits
+        state = self.state
+        bit_entries = self.bit_entries
+        chunks: List[str] = list()
+        while acc_bits > 0:
+            acc_bits -= 1
+            out, state = bit_entries[(state << 1) | ((acc >> acc_bits) & 1)]
+            if out:
+                chunks.append(out)
+        self.reset()
+        return ''.join(chunks)
+
+    def decode(self, data: bytes, last_byte_bits: int) -> str:
+        # Decodes a packed bitstream whose last byte holds only `last_byte_bits` meaningful bits (msb first).
+        if not data:
+            return ""
+        self.reset()
+        return self.feed(data[:-1]) + self.finish(data[-1] >> (8 - last_byte_bits), last_byte_bits)
+
+    def decode_view(self, payload: memoryview, dst: TextIO, last_byte_bits: int, chunk_size: int) -> None:
+        # Decodes a whole payload held in memory (a mapped file) into dst, chunk by chunk through slices of the view.
+        self.reset()
+        if not payload:
+            return
+        end = len(payload) - 1
+        for start in range(0, end, chunk_size):
+            with payload[start:min(start + chunk_size, end)] as chunk:
+                dst.write(self.feed(chunk))
+        dst.write(self.finish(payload[end] >> (8 - last_byte_bits), last_byte_bits))
+
+    def decode_stream(self, src: BinaryIO, dst: TextIO, last_byte_bits: int, chunk_size: int, payload_bytes: int = None) -> None:
+        # Decodes the rest of src (or its next payload_bytes bytes) into dst,
+        # the last byte is held back until the end of the payload is seen.
+        self.reset()
+        held: bytes = b""
+        remaining: int = payload_bytes if payload_bytes is not None else -1
+        while remaining != 0:
+            chunk = src.read(chunk_size if remaining < 0 else min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk) if remaining > 0 else 0
+            chunk = held + chunk
+            held = chunk[-1:]
+            dst.write(self.feed(memoryview(chunk)[:-1]))
+        if held:
+            dst.write(self.finish(held[0] >> (8 - last_byte_bits), last_byte_bits))
+
+    def decode_span(self, src: BinaryIO, skip_bits: int, payload_bytes: int, last_byte_bits: int, count: int, chunk_size: int) -> str:
+        # Decodes at least `count` characters (or up to the end of the payload) starting `skip_bits` bits into the
+        # next byte of src. payload_bytes is the number of payload bytes left from that byte on.
+        self.reset()
+        chunks: List[str] = list()
+        produced: int = 0
+        first: bool = True
+        while produced < count and payload_bytes > 1:
+            chunk = src.read(min(chunk_size, payload_bytes - 1))
+            payload_bytes -= len(chunk)
+            if first is True and skip_bits:
+                self.acc, self.acc_bits = chunk[0] & ((1 << (8 - skip_bits)) - 1), 8 - skip_bits
+                chunk = chunk[1:]
+            first = False
+            text = self.feed(chunk)
+            chunks.append(text)
+            produced += len(text)
+        if produced < count and payload_bytes == 1:
+            last_byte = src.read(1)[0] >> (8 - last_byte_bits)
+            tail_bits = last_byte_bits
+            if first is True and skip_bits:
+                last_byte &= (1 << (last_byte_bits - skip_bits)) - 1
+                tail_bits -= skip_bits
+            chunks.append(self.finish(last_byte, tail_bits))
+        return ''.join(chunks)
+
+class ContextDecodeTable(DecodeTable):
+    # DecodeTable of an order-1 context model (see huffman_context.py). The states are the internal nodes of the trees
+    # of all the clusters, and a decoded symbol moves to the root of the tree of the cluster it's the context for,
+    # so the tables switch inside a lookup and feed() runs the same loop as for a single tree.
+    def __init__(self, model: ContextModel, table_bits: int = 8) -> None:
+        self.model: ContextModel = model
+        self.trees: List[CodeTree] = [CodeTree.from_codes(canonical_codes(ordered)) for ordered in model.tables]
+        self.cluster_states: List[Tuple[int, int]] = list()     # created by: build_states(), (cluster, node) of every state
+        self.cluster_state_index: List[array] = list()          # created by: build_states(), per cluster the state of every internal node
+        self.root_states: List[int] = list()                    # created by: build_states(), the state of every cluster's root
+        self.next_state: Dict[str, int] = dict()                # created by: build_states(), symbol -> root state of the cluster after it
+        super().__init__(tree=None, table_bits=table_bits)
+
+    def build_states(self) -> None:
+        for cluster, tree in enumerate(self.trees):
+            self.root_states.append(len(self.cluster_states))
+            state_index = array('i', [NO_NODE]) * len(tree)
+            if len(tree) == 0 or tree.is_leaf(tree.root):
+                self.cluster_states.append((cluster, tree.root))
+            else:
+                for node in tree.preorder():
+                    if not tree.is_leaf(node):
+                        state_index[node] = len(self.cluster_states)
+                        self.cluster_states.append((cluster, node))
+            self.cluster_state_index.append(state_index)
+        self.next_state = {symbol: self.root_states[self.model.cluster_of(symbol)] for symbol in self.model.symbols()}
+        self.states = [node for _, node in self.cluster_states]
+
+    def step(self, state: int, bit: int) -> Tuple[str, int]:
+        cluster, node = self.cluster_states[state]
+        tree = self.trees[cluster]
+        if node == NO_NODE:         # empty tree, there is nothing to decode
+            return "", state
+        if not tree.is_leaf(node):
+            node = tree.right[node] if bit else tree.left[node]
+        if tree.is_leaf(node):
+            symbol = tree.symbol(node)
+            return symbol, self.next_state[symbol]
+        return "", self.cluster_state_index[cluster][node]
+
+    def reset(self) -> None:
+        super().reset()
+        self.state = self.root_states[self.model.cluster_of(START_CONTEXT)]
+
+def decode_table_from_header(header: ContainerHeader, model_store: "ModelStore" = None, table_bits: int = 8) -> DecodeTable:
+    if header.table_kind == TABLE_CONTEXT:
+        return ContextDecodeTable(ContextModel.from_bytes(header.table), table_bits)
+    return DecodeTable(tree_from_header(header, model_store), table_bits)
+
+class ModelStore:
+    # Loads trained models from `directory` by id and keeps them, with their decode tables, for later messages.
+    def __init__(self, directory: str = ".", table_bits: int = 8) -> None:
+        self.directory: str = directory
+        self.table_bits: int = check_table_bits(table_bits)
+        self.models: Dict[bytes, HuffmanModel] = dict()
+        self.decode_tables: Dict[bytes, DecodeTable] = dict()
+
+    def add(self, model: HuffmanModel) -> None:
+        self.models[model.model_id] = model
+
+    def model(self, model_id: bytes) -> HuffmanModel:
+        if model_id not in self.models:
+            path = os.path.join(self.directory, HuffmanModel.file_name(model_id))
+            if not os.path.exists(path):
+                raise HuffmanError(f"unknown model {model_id.hex()}, no {path}")
+            self.add(HuffmanModel.load(path))
+        return self.models[model_id]
+
+    def decode_table(self, model_id: bytes) -> DecodeTable:
+        if model_id not in self.decode_tables:
+            tree = CodeTree.from_codes(canonical_codes(self.model(model_id).ordered))
+            self.decode_tables[model_id] = DecodeTable(tree, self.table_bits)
+        return self.decode_tables[model_id]
 
 class HuffmanDecoder:
-    # ASCII Control Characters are: (0x00 to 0x1F, 0x7F)
-    # apart from the ASCII control characters (0x00 to 0x1F and 0x7F), 
-    # all other characters in the ASCII table (0x20 to 0x7E, 0xFF) are printable 
-    # and can be normally written into a text file as characters.
-    control_characters: List[str] = [f"{bin(num)[2:]:>08}" for num in list(range(0x00, 0x1F+1)) + [0x7F]]
-    backslash_code: str = f"{bin(0x5C)[2:]:>08}"
-    encoded_forms: List[str] = [f"1{str_bin[1:]}" for str_bin in control_characters + [backslash_code]]
-
-    def __init__(self, compressed_file: str, decompressed_file: str) -> None:
+    # "table" decodes `table_bits` bits per lookup using DecodeTable,
+    # "tree" is the original bit-at-a-time walk, kept as a reference to check and benchmark against.
+    # The walk only decodes files with a single tree, see check_engine().
+    engines: List[str] = ["table", "tree"]
+
+    # workers is the number of processes decoding a block mode file, all cores by default.
+    # model_store finds the trained model of a file compressed against one.
+    def __init__(self, compressed_file: str, decompressed_file: str, engine: str = "table", table_bits: int = 8, legacy_text: bool = False,
+                 workers: int = None, model_store: ModelStore = None) -> None:
         self.compressed_file: str = compressed_file
         self.decompressed_file: str = decompressed_file
+        self.workers: int = workers
+        self.model_store: ModelStore = model_store
+        # legacy_text reads the old escaped-text format with its Inorder/Preorder footer
+        self.legacy_text: bool = legacy_text
+        if engine not in self.engines:
+            raise HuffmanError(f"unknown decoding engine = {engine}, expected one of {self.engines}")
+        self.engine: str = engine
+        self.table_bits: int = check_table_bits(table_bits)
         self.inorder: Order     # created by: extract_ordered_lists()
         self.preorder: Order    # created by: extract_ordered_lists()
-        self.root: TreeNode     # created by: spawn_huffman_tree()
-        self.path2char_decoding_dict: Dict[str, str] = dict()    # created by: tree_to_encoding_dict()
+        self.header: ContainerHeader = None     # created by: read_header()
+        self.payload_start: int = None          # created by: read_header(), the offset right after the header
+        self.payload_size: int = None           # created by: read_header(), None when the payload runs to the end of the file
+        self.tree: CodeTree     # created by: spawn_huffman_tree()
+        self.path2char_decoding_dict: Dict[str, str] = dict()    # created by: tree_to_decoding_dict()
+        self.decode_table: DecodeTable = None   # created by: write2file() when engine == "table"
         #
-        self.extract_ordered_lists()
+        if self.legacy_text is True:
+            self.extract_ordered_lists()
+        else:
+            self.read_header()
+            self.check_engine()
         self.spawn_huffman_tree()
-        self.tree_to_decoding_dict(self.root)
+        self.tree_to_decoding_dict()
         self.write2file()
 
-        # print(f"{self.root = }")
+        # print(f"{self.tree = }")
         # print(f"{self.path2char_decoding_dict = }")
 
-    @staticmethod
-    def char_2_str_bin(char: str) -> str:
-         # Convert the character to its ASCII value
-        ascii_value = ord(char)
-        # Convert the ASCII value to a binary string, remove the '0b' prefix, and ensure it's 8 bits long
-        binary_representation = bin(ascii_value)[2:].zfill(8)
-        return binary_representation
-    
-    @classmethod
-    def char_decoder(cls, encoded_char: str, special: bool) -> str: # returns a binary string of 1s and 0s
-        ascii_bin = cls.char_2_str_bin(encoded_char)
-        if special is False:
-            return ascii_bin
-        # Backslash is used to show that the next char should be treated as a problematic char or backslash when encoding.
-        # Since all problematic chars and backslash have '0' in their leftmost bit, we just flip it.
-        return '0' + ascii_bin[1:8]
-
-    def tree_to_decoding_dict(self, node: TreeNode) -> None:
-        if node.is_leaf is True:
-            self.path2char_decoding_dict[node.path] = node.val
+    def check_engine(self) -> None:
+        # The tree walk decodes a single tree over the whole payload. Block, segment, adaptive and context files
+        # are decoded with DecodeTable only.
+        if self.engine == "table":
             return
-        self.tree_to_decoding_dict(node.left)
-        self.tree_to_decoding_dict(node.right)
+        if self.header.flags & FLAG_BLOCKS:
+            unsupported = "a block mode file"
+        elif self.header.flags & FLAG_SEGMENTS:
+            unsupported = "an appended file"
+        elif self.header.table_kind == TABLE_ADAPTIVE:
+            unsupported = "an adaptive file"
+        elif self.header.table_kind == TABLE_CONTEXT:
+            unsupported = "a context mode file"
+        else:
+            return
+        raise HuffmanError(f"decoding engine = {self.engine} can't decode {unsupported}, use engine = table")
+
+    def tree_to_decoding_dict(self) -> None:
+        if self.tree is None:
+            return
+        self.path2char_decoding_dict = {code_to_path(code, length): char for char, (code, length) in self.tree.leaf_codes().items()}
 
     def spawn_huffman_tree(self) -> None:
-        self.root = TreeNode.buildTree(self.preorder.list_form, self.inorder.list_form)
-        if self.root.is_leaf is True:
-            self.root.path = '0'
+        if self.legacy_text is False and self.header.table_kind in (TABLE_ADAPTIVE, TABLE_CONTEXT):
+            self.tree = None    # the adaptive decoder grows its own tree, ContextDecodeTable builds one per cluster
+            return
+        if self.legacy_text is False:
+            self.tree = tree_from_header(self.header, self.model_store)
+            return
+        with profile_stage("tree") as stage:
+            self.tree = CodeTree.from_orders(self.preorder.list_form, self.inorder.list_form)
+            stage.add(nodes=len(self.tree))
+
+    def read_header(self) -> None:
+        if not os.path.exists(self.compressed_file):
+            raise HuffmanError(f"compressed file path is wrong = {self.compressed_file}")
+        with open(file=self.compressed_file, mode='rb') as fd:
+            try:
+                self.header = ContainerHeader.from_fd(fd)
+            except ValueError as e:
+                raise HuffmanError(f"can't read the compressed file header: {e}") from e
+            self.payload_start = fd.tell()
+            self.payload_size = payload_size(fd, self.header)
+        if self.header.table_kind not in (TABLE_TREE, TABLE_CANONICAL, TABLE_MODEL, TABLE_ADAPTIVE, TABLE_BYTES, TABLE_CONTEXT):
+            raise HuffmanError(f"unsupported code table kind = {self.header.table_kind}")
 
     def extract_ordered_lists(self) -> None:
+        if not os.path.exists(self.compressed_file):
+            raise HuffmanError(f"compressed file path is wrong = {self.compressed_file}")
         lines: List[str]
         with open(file=self.compressed_file, mode='r') as fd:
             lines = fd.readlines()
@@ -144,63 +409,379 @@ class HuffmanDecoder:
     def write2file(self) -> None:
         # Check if the target file exists
         if not os.path.exists(self.compressed_file):
-            print(f"compressed file path is wrong = {self.compressed_file}, exiting...")
-            exit(1)
+            raise HuffmanError(f"compressed file path is wrong = {self.compressed_file}")
         if not os.path.exists(self.decompressed_file):
             # If it doesn't exist, create the file by opening it in write mode and then closing it
             open(file=self.decompressed_file, mode='w', encoding='utf-8').close()
-            print(f"Created the file, ", end='')
-        
-        # If it exists, open the target file in write mode and the source file in read mode
-        with open(file=self.compressed_file, mode='r', encoding='utf-8') as compressed_fd, open(file=self.decompressed_file, mode='w', encoding='utf-8') as decompressed_fd:
-            lines = compressed_fd.readlines()
-            last_char_relevant_bits = eval(lines[0][-2])
-            # print(f"\n{last_char_relevant_bits = }")
-            # Move lines from the source file to the target file
-            special = False
-            curr_node: TreeNode = self.root
-            for l, char in enumerate(lines[0][:-2]):
-                if char == '\\':
-                    special = True
-                    continue
-                path = self.char_decoder(char, special)
-                if l == len(lines[0])-3:
-                    path = path[:last_char_relevant_bits]
-                special = False
-                i:int = 0
-                while i < len(path):
-                    if curr_node.is_leaf is True:
-                        decompressed_fd.write(curr_node.val)
-                        if curr_node == self.root:
-                            i+=1
+        with profile_stage("decode") as stage:
+            self.decode_to_file()
+            stage.add(bytes_in=os.path.getsize(self.compressed_file), bytes_out=os.path.getsize(self.decompressed_file))
+            if self.legacy_text is False and self.header.table_kind != TABLE_ADAPTIVE and not self.header.flags & FLAG_SEGMENTS:
+                stage.add(symbols=self.header.original_length)
+
+    def decode_to_file(self) -> None:
+        if self.legacy_text is False and self.header.flags & FLAG_SEGMENTS:
+            # an appended file, the segments decode one after the other into an output whose size isn't in the first header
+            with open(file=self.compressed_file, mode='rb') as compressed_fd, self.open_decompressed(mapped=False) as decompressed_fd:
+                compressed_fd.seek(self.payload_start)
+                decode_segments(compressed_fd, decompressed_fd, self.header, 0, CHUNK_SIZE, self.table_bits, self.model_store, self.workers)
+            return
+
+        if self.legacy_text is False and self.header.table_kind == TABLE_ADAPTIVE:
+            with open(file=self.compressed_file, mode='rb') as compressed_fd, open(file=self.decompressed_file, mode='w', encoding='utf-8') as decompressed_fd:
+                compressed_fd.seek(self.payload_start)
+                decompress_adaptive(compressed_fd, decompressed_fd, CHUNK_SIZE)
+            return
+
+        if self.legacy_text is False and self.header.flags & FLAG_BLOCKS:
+            with open(file=self.compressed_file, mode='rb') as compressed_fd, self.open_decompressed() as decompressed_fd:
+                compressed_fd.seek(self.payload_start)
+                decode_blocks(compressed_fd, decompressed_fd, self.header, self.table_bits, self.workers, self.tree)
+            return
+
+        if self.legacy_text is True:
+            with open(file=self.compressed_file, mode='r', encoding='utf-8') as compressed_fd:
+                lines = compressed_fd.readlines()
+            data, last_byte_bits = self.line_to_bytes(lines[0])
+            with self.open_decompressed() as decompressed_fd:
+                if self.engine == "table":
+                    self.write_table_lookup(data, last_byte_bits, decompressed_fd)
+                else:
+                    self.write_tree_walk(data, last_byte_bits, decompressed_fd)
+            return
+
+        # The compressed file is mapped and the payload is decoded straight from a view of the mapping.
+        start = self.payload_start
+        last_byte_bits = 8 - self.header.padding_bits
+        with map_file(self.compressed_file) as compressed_view:
+            end = len(compressed_view) if self.payload_size is None else start + self.payload_size
+            with compressed_view[start:end] as payload:
+                if self.engine == "table":
+                    with self.open_decompressed() as decompressed_fd:
+                        # the tree spawn_huffman_tree() built, context mode has one per cluster instead
+                        if self.tree is None:
+                            self.decode_table = decode_table_from_header(self.header, self.model_store, self.table_bits)
                         else:
-                            curr_node = self.root
-                    else:
-                        tree_step = path[i]
+                            self.decode_table = DecodeTable(self.tree, self.table_bits)
+                        self.decode_table.decode_view(payload, decompressed_fd, last_byte_bits, CHUNK_SIZE)
+                else:
+                    # one write per character, a buffered file is faster than the mapped output here
+                    with self.open_decompressed(mapped=False) as decompressed_fd:
+                        self.write_tree_walk(payload, last_byte_bits, decompressed_fd)
+
+    def open_decompressed(self, mapped: bool = True) -> TextIO:
+        # When the size of the output in bytes is known from the header, the output file is preallocated and mapped
+        # (see MappedWriter): byte symbols are one byte each, and so are the characters of an all-ASCII code table
+        # as long as newlines are written untranslated.
+        if self.legacy_text is False and self.header.table_kind == TABLE_BYTES:
+            if mapped is True:
+                return MappedWriter(self.decompressed_file, self.header.original_length, BYTE_SYMBOL_ENCODING)
+            return open(file=self.decompressed_file, mode='w', encoding=BYTE_SYMBOL_ENCODING, newline='')
+        if mapped is True and self.legacy_text is False and os.linesep == "\n":
+            # a context model has no single tree, its symbols are those of all its tables
+            symbols = ContextModel.from_bytes(self.header.table).symbols() if self.header.table_kind == TABLE_CONTEXT else self.path2char_decoding_dict.values()
+            if all(symbol.isascii() for symbol in symbols):
+                return MappedWriter(self.decompressed_file, self.header.original_length, 'ascii')
+        return open(file=self.decompressed_file, mode='w', encoding='utf-8')
+
+    @classmethod
+    def line_to_bytes(cls, line: str) -> Tuple[bytearray, int]:
+        # Undoes str_bin_encoder: returns the packed bitstream and the number of relevant bits in its last byte.
+        last_char_relevant_bits = int(line[-2])
+        data = bytearray()
+        special = False
+        for char in line[:-2]:
+            if char == '\\' and special is False:
+                special = True
+                continue
+            data.append(ord(char) & 0x7F if special else ord(char))
+            special = False
+        return data, last_char_relevant_bits
+
+    def write_table_lookup(self, data: bytes, last_byte_bits: int, decompressed_fd) -> None:
+        self.decode_table = DecodeTable(self.tree, self.table_bits)
+        decompressed_fd.write(self.decode_table.decode(data, last_byte_bits))
+
+    def write_tree_walk(self, data: bytes, last_byte_bits: int, decompressed_fd) -> None:
+        tree = self.tree
+        if len(tree) == 0:      # empty tree, there is nothing to decode
+            return
+        root, left, right = tree.root, tree.left, tree.right
+        # the character of every leaf and None for internal nodes, so the walk needs a single lookup per node
+        chars: List[str] = [chr(symbol) if symbol != NO_NODE else None for symbol in tree.symbols]
+        curr_node: int = root
+        for l, byte in enumerate(data):
+            path = f"{byte:08b}"
+            if l == len(data)-1:
+                path = path[:last_byte_bits]
+            i:int = 0
+            while i < len(path):
+                char = chars[curr_node]
+                if char is not None:
+                    decompressed_fd.write(char)
+                    if curr_node == root:
                         i+=1
-                        if tree_step == '0':
-                            curr_node = curr_node.left
-                        else:
-                            curr_node = curr_node.right
-            if self.root.is_leaf is not True:
-                decompressed_fd.write(curr_node.val)
+                    else:
+                        curr_node = root
+                else:
+                    tree_step = path[i]
+                    i+=1
+                    if tree_step == '0':
+                        curr_node = left[curr_node]
+                    else:
+                        curr_node = right[curr_node]
+        if not tree.is_leaf(root) and data:
+            decompressed_fd.write(tree.symbol(curr_node))
+
+def payload_size(src: BinaryIO, header: ContainerHeader) -> int:
+    # Number of payload bytes after the header when an index follows the payload, None if it runs to the end.
+    # src must be positioned right after the header and is left there.
+    if not header.flags & FLAG_SEEK_INDEX:
+        return None
+    payload_start = src.tell()
+    index_offset, _ = read_footer(src)
+    src.seek(payload_start)
+    return index_offset - payload_start
+
+# Decode table of a block worker process, built once by init_block_decoder() instead of per block.
+block_worker_table: DecodeTable = None
+
+def init_block_decoder(header: ContainerHeader, table_bits: int, tree: CodeTree = None) -> None:
+    global block_worker_table
+    block_worker_table = DecodeTable(tree if tree is not None else tree_from_header(header), table_bits)
+
+def decode_block(block: Tuple[bytes, int, List[int]]) -> str:
+    return decode_interleaved(block_worker_table, *block)
+
+def decode_interleaved(table: DecodeTable, data: bytes, symbol_count: int, bit_lengths: List[int]) -> str:
+    # Decodes one block of len(bit_lengths) byte aligned streams, one after the other, and interleaves them back:
+    # stream s fills the slots s, s + K, s + 2K, ... of the block. A block without FLAG_STREAMS is one stream.
+    count = len(bit_lengths)
+    view = memoryview(data)
+    texts: List[str] = list()
+    offset: int = 0
+    for stream, bit_length in enumerate(bit_lengths):
+        size = (bit_length + 7) >> 3
+        text = table.decode(view[offset:offset + size], bit_length - 8 * (size - 1))
+        if len(text) != len(range(stream, symbol_count, count)):
+            raise HuffmanError(f"a block stream decoded to {len(text)} characters, the block index says otherwise, the data is corrupt")
+        texts.append(text)
+        offset += size
+    if count == 1:
+        return texts[0]
+    out: List[str] = [""] * symbol_count
+    for stream, text in enumerate(texts):
+        out[stream::count] = text
+    return ''.join(out)
+
+def block_bytes(bit_lengths: List[int]) -> int:
+    return sum((bit_length + 7) >> 3 for bit_length in bit_lengths)
+
+def read_blocks(src: BinaryIO, block_index: BlockIndex, stream_count: int) -> Iterator[Tuple[bytes, int, List[int]]]:
+    for _, symbol_count, bit_lengths in block_index.blocks(stream_count):
+        yield src.read(block_bytes(bit_lengths)), symbol_count, bit_lengths
+
+def decode_blocks(src: BinaryIO, dst: TextIO, header: ContainerHeader, table_bits: int = 8, workers: int = None, tree: CodeTree = None) -> None:
+    # src is positioned right after the header, the block index is read from the end of the file
+    # and the blocks are decoded by `workers` processes and written in order. A tree already built from the header is reused.
+    payload_start = src.tell()
+    block_index, _ = BlockIndex.from_footer(src)
+    src.seek(payload_start)
+    for text in ordered_map(decode_block, read_blocks(src, block_index, header.stream_count), workers=workers,
+                            initializer=init_block_decoder, initargs=(header, table_bits, tree)):
+        dst.write(text)
+
+def decompress_file(compressed_file_path: str, decompressed_file_path: str, engine: str = "table", table_bits: int = 8,
+                    legacy_text: bool = False, workers: int = None, model_store: ModelStore = None) -> HuffmanDecoder:
+    # Decompresses the file into decompressed_file_path without printing, returns the decoder that wrote it.
+    with corrupt_data_errors():
+        return HuffmanDecoder(compressed_file=compressed_file_path, decompressed_file=decompressed_file_path, engine=engine, table_bits=table_bits,
+                              legacy_text=legacy_text, workers=workers, model_store=model_store)
+
+def decompress_stream(src: BinaryIO, dst: TextIO, chunk_size: int = CHUNK_SIZE, table_bits: int = 8, model_store: ModelStore = None) -> None:
+    # Decompresses the binary container stream src into the text stream dst with memory bounded by chunk_size.
+    # Block mode containers need a seekable src to reach the block index. Byte symbol containers need a binary dst.
+    # Appended files (FLAG_SEGMENTS) need a seekable src to reach their segment index.
+    with profile_stage("decode") as stage, corrupt_data_errors():
+        container_start = src.tell() if src.seekable() else 0
+        header = ContainerHeader.from_fd(src)
+        if header.table_kind != TABLE_ADAPTIVE and not header.flags & FLAG_SEGMENTS:
+            stage.add(symbols=header.original_length)
+        if header.table_kind == TABLE_BYTES:
+            if isinstance(dst, io.TextIOBase):
+                raise HuffmanError("the container holds bytes, decompress_stream() needs a binary dst")
+            text_dst = io.TextIOWrapper(dst, encoding=BYTE_SYMBOL_ENCODING, newline='', write_through=True)
+            decode_container(src, text_dst, header, container_start, chunk_size, table_bits, model_store)
+            text_dst.flush()
+            text_dst.detach()
+            return
+        decode_container(src, dst, header, container_start, chunk_size, table_bits, model_store)
+
+def decode_container(src: BinaryIO, dst: TextIO, header: ContainerHeader, container_start: int, chunk_size: int, table_bits: int,
+                     model_store: ModelStore = None, workers: int = None) -> None:
+    # Decodes what follows the header into dst, by the layout the header describes. src is positioned right after the header,
+    # container_start is where the header starts. Byte symbols are written as BYTE_SYMBOL_ENCODING text.
+    if header.flags & FLAG_SEGMENTS:
+        decode_segments(src, dst, header, container_start, chunk_size, table_bits, model_store, workers)
+        return
+    if header.table_kind == TABLE_ADAPTIVE:
+        decompress_adaptive(src, dst, chunk_size)
+        return
+    if header.flags & FLAG_BLOCKS:
+        decode_blocks(src, dst, header, table_bits, workers)
+        return
+    decode_table_from_header(header, model_store, table_bits).decode_stream(src, dst, 8 - header.padding_bits, chunk_size, payload_size(src, header))
+
+def read_segment_header(segment: SegmentFile, previous: ContainerHeader) -> ContainerHeader:
+    # The header of one segment of an appended file, as the header of a container of its own: FLAG_SEGMENTS is
+    # cleared and TABLE_PREVIOUS is replaced by the table of the segment before it.
+    header = ContainerHeader.from_fd(segment)
+    header.flags &= ~FLAG_SEGMENTS
+    if header.table_kind == TABLE_PREVIOUS:
+        if previous is None or previous.table_kind == TABLE_ADAPTIVE:
+            raise HuffmanError("a segment reuses the code table of the segment before it, which has none, the data is corrupt")
+        header.table_kind, header.table = previous.table_kind, previous.table
+    return header
+
+def decode_segments(src: BinaryIO, dst: TextIO, first_header: ContainerHeader, container_start: int, chunk_size: int, table_bits: int,
+                    model_store: ModelStore = None, workers: int = None) -> int:
+    # Decodes the segments of an appended file in order, each through a SegmentFile as a container of its own.
+    # Returns the number of symbols the segment headers add up to, None when an adaptive segment doesn't record its own.
+    if not src.seekable():
+        raise HuffmanError("the container has appended segments, decoding it needs a seekable src")
+    segment_index, end = SegmentIndex.read(src, container_start)
+    previous: ContainerHeader = None
+    symbols: int = 0
+    for start, stop in segment_index.bounds(end):
+        segment = SegmentFile(src, container_start + start, container_start + stop)
+        header = read_segment_header(segment, previous)
+        if (header.table_kind == TABLE_BYTES) != (first_header.table_kind == TABLE_BYTES):
+            raise HuffmanError("the segments mix byte symbols and text, the data is corrupt")
+        decode_container(segment, dst, header, 0, chunk_size, table_bits, model_store, workers)
+        symbols = None if symbols is None or header.table_kind == TABLE_ADAPTIVE else symbols + header.original_length
+        previous = header
+    return symbols
+
+def decompress_message(blob: bytes, model_store: ModelStore) -> str:
+    # Decompresses one in-memory message, model messages reuse the cached decode table of their model.
+    with corrupt_data_errors():
+        fd = io.BytesIO(blob)
+        header = ContainerHeader.from_fd(fd)
+        if header.table_kind == TABLE_MODEL:
+            table = model_store.decode_table(header.table)
+        else:
+            table = decode_table_from_header(header, table_bits=model_store.table_bits)
+        return table.decode(memoryview(blob)[fd.tell():], 8 - header.padding_bits)
+
+def read_range(compressed_file: str, start: int, length: int, table_bits: int = 8, chunk_size: int = CHUNK_SIZE) -> Union[str, bytes]:
+    # Returns characters [start, start + length) of the original text. With a seek index or in block mode only
+    # the span from the nearest checkpoint or block is decoded, otherwise decoding starts at the beginning.
+    # Byte symbol containers give bytes [start, start + length) of the original file.
+    with open(file=compressed_file, mode='rb') as fd, corrupt_data_errors():
+        header = ContainerHeader.from_fd(fd)
+        if header.flags & FLAG_SEGMENTS:
+            text = read_segments_range(fd, start, length, table_bits, chunk_size)
+            return text.encode(BYTE_SYMBOL_ENCODING) if header.table_kind == TABLE_BYTES else text
+        if header.table_kind == TABLE_ADAPTIVE:
+            return read_adaptive_range(fd, start, start + length, chunk_size)
+        if header.table_kind == TABLE_BYTES:
+            return read_text_range(fd, header, start, length, table_bits, chunk_size).encode(BYTE_SYMBOL_ENCODING)
+        return read_text_range(fd, header, start, length, table_bits, chunk_size)
+
+def read_text_range(fd: BinaryIO, header: ContainerHeader, start: int, length: int, table_bits: int, chunk_size: int) -> str:
+    # fd is positioned right after the header
+    payload_start = fd.tell()
+    end = min(start + length, header.original_length)
+    if start >= end:
+        return ""
+    table = decode_table_from_header(header, table_bits=table_bits)
+    if header.flags & FLAG_BLOCKS:
+        return read_block_range(fd, payload_start, table, start, end, header.stream_count)
+    if header.flags & FLAG_SEEK_INDEX:
+        bit_offset, decoded_offset, payload_end = SeekIndex.lookup(fd, start)
+    else:
+        bit_offset, decoded_offset, payload_end = 0, 0, fd.seek(0, 2)
+    if payload_start + (bit_offset >> 3) > payload_end:
+        raise HuffmanError(f"checkpoint at bit {bit_offset} is past the end of the payload, the data is corrupt")
+    fd.seek(payload_start + (bit_offset >> 3))
+    text = table.decode_span(fd, bit_offset & 7, payload_end - fd.tell(), 8 - header.padding_bits, end - decoded_offset, chunk_size)
+    return text[start - decoded_offset:end - decoded_offset]
+
+def read_segments_range(fd: BinaryIO, start: int, length: int, table_bits: int, chunk_size: int) -> str:
+    # Only the segments overlapping the range are decoded, the lengths in the headers locate them.
+    # An adaptive segment doesn't record its length, it's decoded whole when the range reaches it.
+    segment_index, index_offset = SegmentIndex.read(fd)
+    end = start + length
+    texts: List[str] = list()
+    previous: ContainerHeader = None
+    position: int = 0
+    for segment_start, segment_stop in segment_index.bounds(index_offset):
+        if position >= end:
+            break
+        segment = SegmentFile(fd, segment_start, segment_stop)
+        header = read_segment_header(segment, previous)
+        previous = header
+        if header.table_kind == TABLE_ADAPTIVE:
+            text = read_adaptive_range(segment, 0, sys.maxsize, chunk_size)
+            texts.append(text[max(start - position, 0):end - position])
+            position += len(text)
+            continue
+        if position + header.original_length > start:
+            local_start = max(start - position, 0)
+            texts.append(read_text_range(segment, header, local_start, end - position - local_start, table_bits, chunk_size))
+        position += header.original_length
+    return ''.join(texts)
+
+def read_adaptive_range(fd: BinaryIO, start: int, end: int, chunk_size: int) -> str:
+    # The adaptive code at any point depends on everything before it, so decoding always starts at the beginning.
+    decoder = AdaptiveDecoder()
+    texts: List[str] = list()
+    produced: int = 0
+    while produced < end and decoder.done is False:
+        chunk = fd.read(chunk_size)
+        if not chunk:
+            decoder.finish()
+            break
+        text = decoder.feed(chunk)
+        texts.append(text)
+        produced += len(text)
+    return ''.join(texts)[start:end]
+
+def read_block_range(fd: BinaryIO, payload_start: int, table: DecodeTable, start: int, end: int, stream_count: int = 1) -> str:
+    block_index, index_offset = BlockIndex.from_footer(fd)
+    texts: List[str] = list()
+    block_start: int = 0
+    first_start: int = None
+    for offset, symbol_count, bit_lengths in block_index.blocks(stream_count):
+        block_end = block_start + symbol_count
+        if block_end > start and block_start < end:
+            if first_start is None:
+                first_start = block_start
+            if payload_start + offset + block_bytes(bit_lengths) > index_offset:
+                raise HuffmanError(f"block at byte {offset} ends past the block index, the data is corrupt")
+            fd.seek(payload_start + offset)
+            texts.append(decode_interleaved(table, fd.read(block_bytes(bit_lengths)), symbol_count, bit_lengths))
+        block_start = block_end
+    if first_start is None:
+        raise HuffmanError(f"the block index covers {block_start} characters, the header says more, the data is corrupt")
+    return ''.join(texts)[start - first_start:end - first_start]
 
 class Huffman:
-    def __init__(self, text_file_path: str) -> None:
+    # Command line front end over decompress_file(), prints the result. Without decompressed_file_path
+    # the output goes next to this script.
+    def __init__(self, text_file_path: str, legacy_text: bool = False, decompressed_file_path: str = None) -> None:
         ID1:str = "209323658"
         ID2:str = "315932608"
         self.compressed_file_path: str = text_file_path
-        self.decompressed_file_path: str = self.get_file_path(file_name=f"{ID1}_{ID2}_decompressed.txt")
-        self.huffman_decoder: HuffmanDecoder = HuffmanDecoder(compressed_file=self.compressed_file_path, decompressed_file=self.decompressed_file_path)
+        if decompressed_file_path is None:
+            decompressed_file_path = self.get_file_path(file_name=f"{ID1}_{ID2}_decompressed.txt")
+        self.decompressed_file_path: str = decompressed_file_path
+        self.huffman_decoder: HuffmanDecoder = decompress_file(self.compressed_file_path, self.decompressed_file_path, legacy_text=legacy_text)
 
         print()
         print(f"Decompressed file path: {self.decompressed_file_path}")
-        with open(file=self.compressed_file_path, mode='r', encoding='utf-8') as fd:
-            content = fd.read()
-            print(f"Compressed file len = {len(content)}")
-        with open(file=self.decompressed_file_path, mode='r', encoding='utf-8') as fd:
-            content = fd.read()
-            print(f"Decompressed file len = {len(content)}")
+        print(f"Compressed file size = {os.path.getsize(self.compressed_file_path)} bytes")
+        print(f"Decompressed file size = {os.path.getsize(self.decompressed_file_path)} bytes")
 
     @staticmethod
     def get_file_path(file_name: str) -> str:
@@ -208,7 +789,23 @@ class Huffman:
 
 def main() -> None:
     first_argument: str = get_first_arg()
-    Huffman(text_file_path=first_argument)
+    legacy_text: bool = "--legacy-text" in sys.argv[2:]
+    # --profile prints the time and counters of every stage as JSON to stderr, --profile=path writes them to a file
+    profile: bool = "--profile" in sys.argv[2:]
+    profile_path: str = None
+    for arg in sys.argv[2:]:
+        if arg.startswith("--profile="):
+            profile, profile_path = True, arg.split("=", 1)[1]
+    # an optional second argument is the decompressed file path
+    decompressed_file_path: str = sys.argv[2] if len(sys.argv) > 2 and not sys.argv[2].startswith("--") else None
+    try:
+        with profiling() if profile is True else nullcontext() as profiler:
+            Huffman(text_file_path=first_argument, legacy_text=legacy_text, decompressed_file_path=decompressed_file_path)
+        if profiler is not None:
+            write_profile(profiler, profile_path)
+    except (HuffmanError, OSError) as e:
+        print(f"{e}, exiting...")
+        exit(1)
 
 def get_first_arg() -> str:
     if len(sys.argv) > 1:
@@ -0,0 +1,256 @@
+from typing import List, Dict, Tuple, TextIO, BinaryIO
+
+from huffman_format import HuffmanError, ContainerHeader, TABLE_ADAPTIVE, CHUNK_SIZE, FLUSH_BITS, flush_bytes
+from huffman_profile import profile_stage
+
+# Adaptive Huffman coding (FGK): encoder and decoder start from the same empty tree and update it after every
+# symbol, so the code adapts as the text arrives. Compression is a single pass with no code table in the header,
+# which works on pipes and sockets where the two-pass encoder can't read the input twice.
+#
+# The tree starts as the single NYT ("not yet transmitted") node. A new symbol is sent as the code of the NYT node
+# followed by the UTF-8 bytes of the symbol, then the NYT node splits into a new NYT node and the new leaf.
+# The stream ends with the NYT code followed by the byte 0xFF, which never starts a UTF-8 character,
+# and is zero padded to a whole byte. The header's original_length and padding_bits are unused (0).
+
+END_MARKER: int = 0xFF
+
+
+def utf8_length(lead: int) -> int:
+    # number of bytes of the UTF-8 character starting with byte `lead`
+    if lead < 0x80:
+        return 1
+    if lead < 0xE0:
+        return 2
+    if lead < 0xF0:
+        return 3
+    return 4
+
+
+class AdaptiveTree:
+    # Nodes are indexes into parallel lists, node 0 is the root. `order` lists the nodes by decreasing weight
+    # (the sibling property, position 0 is the root and the NYT node is always last) and `first` maps a weight
+    # to the lowest position holding it, so the leader of a weight block is found without a scan.
+    def __init__(self) -> None:
+        self.weight: List[int] = [0]
+        self.parent: List[int] = [-1]
+        self.left: List[int] = [-1]         # -1 for leaves
+        self.right: List[int] = [-1]
+        self.symbol: List[str] = [None]
+        self.order: List[int] = [0]         # position -> node
+        self.position: List[int] = [0]      # node -> position
+        self.first: Dict[int, int] = {0: 0}
+        self.nyt: int = 0
+        self.leaves: Dict[str, int] = dict()
+
+    def add_symbol(self, char: str) -> int:
+        # The NYT node becomes an internal node with the new leaf and a new NYT node as its children,
+        # both weight 0 and placed last. Returns the new leaf.
+        old_nyt = self.nyt
+        leaf, nyt = len(self.weight), len(self.weight) + 1
+        self.weight += [0, 0]
+        self.parent += [old_nyt, old_nyt]
+        self.left += [-1, -1]
+        self.right += [-1, -1]
+        self.symbol += [char, None]
+        self.left[old_nyt], self.right[old_nyt] = nyt, leaf
+        self.position += [len(self.order), len(self.order) + 1]
+        self.order += [leaf, nyt]
+        self.nyt = nyt
+        self.leaves[char] = leaf
+        return leaf
+
+    def swap(self, a: int, b: int) -> None:
+        # exchanges the subtrees rooted at nodes a and b, neither is an ancestor of the other
+        parent, left, right, order, position = self.parent, self.left, self.right, self.order, self.position
+        parent_a, parent_b = parent[a], parent[b]
+        position[a], position[b] = position[b], position[a]
+        order[position[a]], order[position[b]] = a, b
+        if parent_a == parent_b:
+            left[parent_a], right[parent_a] = right[parent_a], left[parent_a]
+            return
+        if left[parent_a] == a:
+            left[parent_a] = b
+        else:
+            right[parent_a] = b
+        if left[parent_b] == b:
+            left[parent_b] = a
+        else:
+            right[parent_b] = a
+        parent[a], parent[b] = parent_b, parent_a
+
+    def update(self, node: int) -> None:
+        # Increments the weights from node up to the root. Every node is first moved to the lead position of its
+        # weight block, so it stays sorted after the increment.
+        weight, parent, order, position, first = self.weight, self.parent, self.order, self.position, self.first
+        q = node
+        while q >= 0:
+            w = weight[q]
+            lead = first[w]
+            papa = parent[q]
+            leader = order[lead]
+            if leader == papa:
+                # The sibling is the NYT node, so the parent has the same weight and leads the block.
+                # q takes the position after it and both are incremented together.
+                lead += 1
+                if order[lead] != q:
+                    self.swap(q, order[lead])
+                weight[q] = weight[papa] = w + 1
+                q = papa
+            else:
+                if leader != q:
+                    self.swap(q, leader)
+                weight[q] = w + 1
+            # the NYT node (weight 0, never updated) is last, so position lead + 1 always exists
+            if weight[order[lead + 1]] == w:
+                first[w] = lead + 1
+            else:
+                del first[w]
+            if w + 1 not in first:
+                first[w + 1] = lead if q != papa else lead - 1
+            q = parent[q]
+
+
+class AdaptiveEncoder:
+    def __init__(self) -> None:
+        self.tree: AdaptiveTree = AdaptiveTree()
+        self.acc: int = 0       # integer bit accumulator, msb first
+        self.acc_bits: int = 0
+        self.symbols: int = 0
+
+    def symbol_count(self) -> int:
+        return self.symbols
+
+    def node_code(self, node: int) -> Tuple[int, int]:
+        # (code, length) of the path from the root to node
+        parent, right = self.tree.parent, self.tree.right
+        code: int = 0
+        length: int = 0
+        papa = parent[node]
+        while papa >= 0:
+            if right[papa] == node:
+                code |= 1 << length
+            length += 1
+            node, papa = papa, parent[papa]
+        return code, length
+
+    def encode(self, chunk: str) -> bytearray:
+        # Returns the whole bytes, fewer than 8 bits are carried into the next call.
+        tree = self.tree
+        leaves = tree.leaves
+        node_code = self.node_code
+        update = tree.update
+        payload = bytearray()
+        acc, acc_bits = self.acc, self.acc_bits
+        for char in chunk:
+            node = leaves.get(char)
+            if node is None:
+                code, length = node_code(tree.nyt)
+                literal = char.encode('utf-8')
+                acc = (((acc << length) | code) << (8 * len(literal))) | int.from_bytes(literal, 'big')
+                acc_bits += length + 8 * len(literal)
+                node = tree.add_symbol(char)
+            else:
+                code, length = node_code(node)
+                acc = (acc << length) | code
+                acc_bits += length
+            update(node)
+            if acc_bits >= FLUSH_BITS:
+                acc, acc_bits = flush_bytes(payload, acc, acc_bits)
+        self.symbols += len(chunk)
+        self.acc, self.acc_bits = flush_bytes(payload, acc, acc_bits)
+        return payload
+
+    def finish(self) -> bytes:
+        # the end marker and the zero padded last byte
+        code, length = self.node_code(self.tree.nyt)
+        acc = (((self.acc << length) | code) << 8) | END_MARKER
+        acc_bits = self.acc_bits + length + 8
+        padding = -acc_bits % 8
+        self.acc, self.acc_bits = 0, 0
+        return (acc << padding).to_bytes((acc_bits + padding) >> 3, 'big')
+
+
+class AdaptiveDecoder:
+    def __init__(self) -> None:
+        self.tree: AdaptiveTree = AdaptiveTree()
+        self.acc: int = 0
+        self.acc_bits: int = 0
+        self.done: bool = False     # the end marker was read, anything after it is ignored
+
+    def feed(self, data: bytes) -> str:
+        # Decodes every complete symbol, bits of an incomplete one are kept for the next call.
+        if self.done is True:
+            return ""
+        tree = self.tree
+        left, right, symbol = tree.left, tree.right, tree.symbol
+        update = tree.update
+        chunks: List[str] = list()
+        acc, acc_bits = self.acc, self.acc_bits
+        for byte in data:
+            acc = (acc << 8) | byte
+            acc_bits += 8
+            while acc_bits:
+                node = 0
+                bits = acc_bits
+                while left[node] >= 0 and bits:
+                    bits -= 1
+                    node = right[node] if (acc >> bits) & 1 else left[node]
+                if left[node] >= 0:
+                    break
+                if node == tree.nyt:
+                    if bits < 8:
+                        break
+                    lead = (acc >> (bits - 8)) & 0xFF
+                    if lead == END_MARKER:
+                        self.done = True
+                        self.acc, self.acc_bits = 0, 0
+                        return ''.join(chunks)
+                    size = utf8_length(lead)
+                    if bits < 8 * size:
+                        break
+                    bits -= 8 * size
+                    try:
+                        char = ((acc >> bits) & ((1 << (8 * size)) - 1)).to_bytes(size, 'big').decode('utf-8')
+                    except UnicodeDecodeError as e:
+                        raise HuffmanError(f"corrupt adaptive stream: {e}") from e
+                    node = tree.add_symbol(char)
+                else:
+                    char = symbol[node]
+                chunks.append(char)
+                update(node)
+                acc_bits = bits
+                acc &= (1 << bits) - 1
+        self.acc, self.acc_bits = acc, acc_bits
+        return ''.join(chunks)
+
+    def finish(self) -> None:
+        if self.done is False:
+            raise HuffmanError("adaptive stream ended without its end marker, the data is truncated")
+
+
+def adaptive_header() -> ContainerHeader:
+    return ContainerHeader(table_kind=TABLE_ADAPTIVE, original_length=0, padding_bits=0, table=b"")
+
+
+def compress_adaptive(src: TextIO, dst: BinaryIO, chunk_size: int = CHUNK_SIZE) -> AdaptiveEncoder:
+    # Reads src once from its current position, src doesn't need to be seekable.
+    encoder = AdaptiveEncoder()
+    with profile_stage("encode") as stage:
+        dst.write(adaptive_header().to_bytes())
+        for chunk in iter(lambda: src.read(chunk_size), ''):
+            dst.write(encoder.encode(chunk))
+        dst.write(encoder.finish())
+        stage.add(symbols=encoder.symbol_count())
+    return encoder
+
+
+def decompress_adaptive(src: BinaryIO, dst: TextIO, chunk_size: int = CHUNK_SIZE) -> None:
+    # src is positioned right after the header
+    decoder = AdaptiveDecoder()
+    with profile_stage("decode"):
+        while decoder.done is False:
+            chunk = src.read(chunk_size)
+            if not chunk:
+                break
+            dst.write(decoder.feed(chunk))
+        decoder.finish()
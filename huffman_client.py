@@ -0,0 +1,82 @@
+from typing import Dict, Any, Union
+import asyncio
+import json
+
+from huffman_format import HuffmanError
+from huffman_protocol import pack_frame, read_frame, NO_MODEL, OP_COMPRESS, OP_DECOMPRESS, OP_STATS, STATUS_OK
+
+# Asyncio client of huffman_server.py. One connection carries any number of concurrent requests,
+# responses are matched to their request by id:
+#
+#   client = await HuffmanClient.connect(unix_path="/tmp/huffman.sock")
+#   blob = await client.compress("some text")
+#   text = await client.decompress(blob)
+#   await client.close()
+
+
+class HuffmanClient:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.reader: asyncio.StreamReader = reader
+        self.writer: asyncio.StreamWriter = writer
+        self.next_id: int = 0
+        self.pending: Dict[int, asyncio.Future] = dict()
+        self.receiver: asyncio.Task = asyncio.create_task(self.receive_loop())
+
+    @classmethod
+    async def connect(cls, unix_path: str = None, host: str = "127.0.0.1", port: int = 8765) -> "HuffmanClient":
+        if unix_path is not None:
+            reader, writer = await asyncio.open_unix_connection(path=unix_path)
+        else:
+            reader, writer = await asyncio.open_connection(host=host, port=port)
+        return cls(reader, writer)
+
+    async def close(self) -> None:
+        self.writer.close()
+        await self.writer.wait_closed()
+        self.receiver.cancel()
+
+    async def receive_loop(self) -> None:
+        error: Exception = HuffmanError("connection closed by the server")
+        try:
+            while True:
+                frame = await read_frame(self.reader)
+                if frame is None:
+                    break
+                request_id, status, _, body = frame
+                future = self.pending.pop(request_id, None)
+                if future is None or future.done():
+                    continue
+                if status == STATUS_OK:
+                    future.set_result(body)
+                else:
+                    future.set_exception(HuffmanError(body.decode('utf-8')))
+        except (HuffmanError, ConnectionError) as e:
+            error = e
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self.pending.clear()
+
+    async def request(self, op: int, body: bytes, model_id: bytes = NO_MODEL) -> bytes:
+        if self.receiver.done():
+            raise HuffmanError("connection closed by the server")
+        request_id = self.next_id
+        self.next_id = (self.next_id + 1) & 0xFFFFFFFF
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        self.writer.write(pack_frame(request_id, op, body, model_id))
+        await self.writer.drain()
+        return await future
+
+    async def compress(self, data: Union[bytes, str], model_id: bytes = None) -> bytes:
+        # model_id is the id of a trained model in the server's model directory
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        return await self.request(OP_COMPRESS, data, model_id if model_id is not None else NO_MODEL)
+
+    async def decompress(self, blob: bytes) -> bytes:
+        # returns the original bytes (UTF-8 for text that was sent as str)
+        return await self.request(OP_DECOMPRESS, blob)
+
+    async def stats(self) -> Dict[str, Any]:
+        return json.loads(await self.request(OP_STATS, b""))
@@ -0,0 +1,85 @@
+from typing import List, Dict, Tuple
+import heapq
+
+from huffman_format import HuffmanError
+
+# Canonical Huffman codes, shared by compression_file.py and decompression_file.py.
+# Only the code length of every symbol is stored, both sides rebuild the same codes from the lengths:
+# symbols are sorted by (length, symbol) and numbered upwards, shifting left whenever the length grows.
+
+
+def canonical_order(code_lengths: Dict[str, int]) -> List[Tuple[str, int]]:
+    return sorted(code_lengths.items(), key=lambda item: (item[1], item[0]))
+
+
+def canonical_codes(ordered: List[Tuple[str, int]]) -> Dict[str, Tuple[int, int]]:
+    # ordered must be in canonical order, returns symbol -> (code, length)
+    check_kraft(ordered)
+    codes: Dict[str, Tuple[int, int]] = dict()
+    code: int = 0
+    prev_length: int = 0
+    for i, (symbol, length) in enumerate(ordered):
+        if i > 0:
+            code = (code + 1) << (length - prev_length)
+        prev_length = length
+        codes[symbol] = (code, length)
+    if len(codes) != len(ordered):
+        raise HuffmanError(f"the code table lists {len(ordered) - len(codes)} symbols twice, the data is corrupt")
+    return codes
+
+
+def check_kraft(ordered: List[Tuple[str, int]]) -> None:
+    # A prefix code that leaves no bit pattern undecodable has sum(2^-length) == 1. An incomplete or oversubscribed
+    # table can only come from corrupt data, its codes would decode to garbage. A single symbol has the one code 0.
+    if len(ordered) <= 1:
+        if ordered and ordered[0][1] != 1:
+            raise HuffmanError(f"a single symbol table has a code of length {ordered[0][1]}, the data is corrupt")
+        return
+    max_length = max(length for _, length in ordered)
+    if min(length for _, length in ordered) < 1 or sum(1 << (max_length - length) for _, length in ordered) != 1 << max_length:
+        raise HuffmanError("the code lengths don't form a complete prefix code, the data is corrupt")
+
+
+def code_to_path(code: int, length: int) -> str:
+    return f"{code:0{length}b}"
+
+
+def check_max_code_length(max_code_length: int) -> int:
+    # None leaves the code lengths uncapped.
+    if max_code_length is not None and max_code_length < 1:
+        raise HuffmanError(f"max_code_length = {max_code_length}, expected at least 1")
+    return max_code_length
+
+
+def limited_code_lengths(char_historgram: Dict[str, int], max_length: int) -> Dict[str, int]:
+    # Package-merge: the optimal code lengths under the constraint that no code is longer than max_length.
+    # Row j holds the symbols plus the pairs ("packages") of row j - 1, sorted by weight. The cheapest 2n - 2
+    # items of the last row are chosen, and every symbol's length is the number of times it appears in them.
+    check_max_code_length(max_length)
+    symbols = sorted(char_historgram, key=lambda symbol: (char_historgram[symbol], symbol))
+    count = len(symbols)
+    if count == 1:
+        return {symbols[0]: 1}
+    if count > 1 << max_length:
+        raise HuffmanError(f"{count} symbols don't fit in codes of at most {max_length} bits")
+    # items 0..count-1 are the symbols, item count + i is package i made of children[i]
+    item_weights: List[int] = [char_historgram[symbol] for symbol in symbols]
+    children: List[Tuple[int, int]] = list()
+    leaves: List[int] = list(range(count))
+    row: List[int] = leaves
+    for _ in range(max_length - 1):
+        packages: List[int] = list()
+        for i in range(0, len(row) - 1, 2):
+            children.append((row[i], row[i + 1]))
+            item_weights.append(item_weights[row[i]] + item_weights[row[i + 1]])
+            packages.append(len(item_weights) - 1)
+        row = list(heapq.merge(leaves, packages, key=item_weights.__getitem__))
+    lengths: List[int] = [0] * count
+    stack: List[int] = row[:2 * count - 2]
+    while stack:
+        item = stack.pop()
+        if item < count:
+            lengths[item] += 1
+        else:
+            stack.extend(children[item - count])
+    return dict(zip(symbols, lengths))
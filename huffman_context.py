@@ -0,0 +1,228 @@
+from typing import List, Dict, Tuple, TextIO, BinaryIO
+from collections import Counter
+
+from huffman_format import HuffmanError, ContainerHeader, TABLE_CONTEXT, CHUNK_SIZE, FLUSH_BITS, flush_bytes, write_varint, read_varint, pack_canonical_table, unpack_canonical_table
+from huffman_codes import canonical_order, canonical_codes, limited_code_lengths, check_max_code_length
+from huffman_tree import CodeTree
+from huffman_profile import profile_stage
+
+# Order-1 context modeling: every character is coded with a table chosen by the character before it, so a text
+# with strong pairs ("q" then "u", "." then " ") spends fewer bits than with one global order-0 table.
+#
+# A context with enough symbols after it gets a canonical table of its own. The rare ones share the fallback
+# table, cluster 0, built from all their symbols together, so the header doesn't pay for a table that saves less
+# than it costs. The first character of the text is coded in the context START_CONTEXT.
+#
+# Table layout (TABLE_CONTEXT, all integers are varints):
+#   cluster_count    number of tables, the fallback table first
+#   tables           per table its byte length and a canonical table (see pack_canonical_table())
+#   context_count    number of contexts with a table of their own
+#   contexts         per context its code point and its cluster, every other context uses cluster 0
+#
+# The decoder (ContextDecodeTable in decompression_file.py) switches tables inside its lookup table,
+# so a lookup costs the same as in order-0 mode.
+
+START_CONTEXT: str = "\n"
+# Contexts with a table of their own, the most frequent first. Bounds the header and the decoder's lookup table.
+MAX_CONTEXT_TABLES: int = 32
+# Every internal node of a table is a state of the decoder's lookup table, with 2**table_bits entries each
+# (table_bits is 8 by default, see DecodeTable). A table is charged one bit per entry it adds, so a context
+# whose savings are small next to the table the decoder builds for it stays in the fallback table.
+STATE_ENTRIES: int = 1 << 8
+# The states of all tables together, the fallback table included. Bounds the decoder's lookup table
+# at about 80 MB whatever the size of the text.
+MAX_CONTEXT_STATES: int = 4096
+
+
+def code_lengths(char_historgram: Dict[str, int], max_code_length: int = None) -> Dict[str, int]:
+    # The Huffman code length of every character, capped by package-merge like HuffmanTree does.
+    lengths = {char: length for char, (code, length) in CodeTree.from_histogram(char_historgram).leaf_codes().items()}
+    if max_code_length is not None and lengths and max(lengths.values()) > max_code_length:
+        lengths = limited_code_lengths(char_historgram, max_code_length)
+    return lengths
+
+
+def count_pairs(chunk: str, previous: str, pair_counts: Counter) -> str:
+    # Adds the (context, character) pairs of the chunk to pair_counts, returns the context of the next chunk.
+    if chunk:
+        pair_counts.update(zip(previous + chunk[:-1], chunk))
+        return chunk[-1]
+    return previous
+
+
+class ContextModel:
+    def __init__(self, tables: List[List[Tuple[str, int]]], context_clusters: Dict[str, int]) -> None:
+        self.tables: List[List[Tuple[str, int]]] = tables         # canonical (symbol, length) pairs per cluster, the fallback first
+        self.context_clusters: Dict[str, int] = context_clusters    # context -> cluster, only the contexts with a table of their own
+
+    def __repr__(self) -> str:
+        return f"ContextModel(clusters={len(self.tables)}, symbols={len(self.symbols())})"
+
+    def cluster_of(self, context: str) -> int:
+        return self.context_clusters.get(context, 0)
+
+    def symbols(self) -> List[str]:
+        return sorted({symbol for ordered in self.tables for symbol, _ in ordered})
+
+    @classmethod
+    def from_pairs(cls, pair_counts: Dict[Tuple[str, str], int], max_code_length: int = None) -> "ContextModel":
+        # The contexts are tried from the most frequent down: a context gets a table of its own when its symbols
+        # cost fewer bits with it, the table and its decoder states included, than with the order-0 code of the whole text.
+        # When no context does, the fallback table is the order-0 table and decoding costs the same as order-0.
+        check_max_code_length(max_code_length)
+        context_historgrams: Dict[str, Dict[str, int]] = dict()
+        global_historgram: Counter = Counter()
+        for (context, char), count in pair_counts.items():
+            if context not in context_historgrams:
+                context_historgrams[context] = dict()
+            context_historgrams[context][char] = count
+            global_historgram[char] += count
+        global_lengths = code_lengths(global_historgram, max_code_length)
+        tables: List[List[Tuple[str, int]]] = [[]]
+        context_clusters: Dict[str, int] = dict()
+        fallback_historgram: Counter = Counter()
+        # the fallback table has at most the states of the order-0 table
+        states = max(len(global_lengths) - 1, 1)
+        for context, char_historgram in sorted(context_historgrams.items(), key=lambda item: (-sum(item[1].values()), item[0])):
+            shared_bits = sum(count * global_lengths[char] for char, count in char_historgram.items())
+            # n symbols make n - 1 states
+            table_states = max(len(char_historgram) - 1, 1)
+            state_bits = STATE_ENTRIES * table_states
+            # at least one bit per symbol plus the symbols of the table, the tree is only built when that could win
+            least_bits = sum(char_historgram.values()) + 8 * (len(''.join(char_historgram).encode('utf-8')) + 4) + state_bits
+            if len(tables) <= MAX_CONTEXT_TABLES and states + table_states <= MAX_CONTEXT_STATES and least_bits < shared_bits:
+                ordered = canonical_order(code_lengths(char_historgram, max_code_length))
+                lengths = dict(ordered)
+                own_bits = sum(count * lengths[char] for char, count in char_historgram.items()) + 8 * (len(pack_canonical_table(ordered)) + 4) + state_bits
+                if own_bits < shared_bits:
+                    context_clusters[context] = len(tables)
+                    tables.append(ordered)
+                    states += table_states
+                    continue
+            fallback_historgram.update(char_historgram)
+        tables[0] = canonical_order(code_lengths(fallback_historgram, max_code_length))
+        return cls(tables, context_clusters)
+
+    def to_bytes(self) -> bytes:
+        table = bytearray()
+        write_varint(table, len(self.tables))
+        for ordered in self.tables:
+            packed = pack_canonical_table(ordered)
+            write_varint(table, len(packed))
+            table += packed
+        write_varint(table, len(self.context_clusters))
+        for context, cluster in self.context_clusters.items():
+            write_varint(table, ord(context))
+            write_varint(table, cluster)
+        return bytes(table)
+
+    @classmethod
+    def from_bytes(cls, table: bytes) -> "ContextModel":
+        cluster_count, pos = read_varint(table, 0)
+        if cluster_count == 0:
+            raise HuffmanError("a context table needs the fallback table, the data is corrupt")
+        tables: List[List[Tuple[str, int]]] = list()
+        for _ in range(cluster_count):
+            size, pos = read_varint(table, pos)
+            tables.append(unpack_canonical_table(table[pos:pos + size]))
+            pos += size
+        context_count, pos = read_varint(table, pos)
+        context_clusters: Dict[str, int] = dict()
+        for _ in range(context_count):
+            code_point, pos = read_varint(table, pos)
+            cluster, pos = read_varint(table, pos)
+            if cluster >= cluster_count or code_point > 0x10FFFF:
+                raise HuffmanError(f"context {code_point} maps to cluster {cluster} of {cluster_count}, the data is corrupt")
+            context_clusters[chr(code_point)] = cluster
+        return cls(tables, context_clusters)
+
+    def cluster_codes(self) -> List[Dict[str, Tuple[int, int]]]:
+        return [canonical_codes(ordered) for ordered in self.tables]
+
+    def payload_bits(self, pair_counts: Dict[Tuple[str, str], int]) -> int:
+        lengths = [dict(ordered) for ordered in self.tables]
+        return sum(count * lengths[self.cluster_of(context)][char] for (context, char), count in pair_counts.items())
+
+
+class ContextEncoder:
+    def __init__(self, model: ContextModel) -> None:
+        self.model: ContextModel = model
+        cluster_codes = model.cluster_codes()
+        # next_codes[char] is the code table of the character after char, so the encode loop switches with one lookup
+        self.next_codes: Dict[str, Dict[str, Tuple[int, int]]] = {symbol: cluster_codes[model.cluster_of(symbol)] for symbol in model.symbols()}
+        self.codes: Dict[str, Tuple[int, int]] = cluster_codes[model.cluster_of(START_CONTEXT)]
+        self.acc: int = 0       # integer bit accumulator, msb first
+        self.acc_bits: int = 0
+        self.symbols: int = 0
+
+    def symbol_count(self) -> int:
+        return self.symbols
+
+    def encode(self, chunk: str) -> bytearray:
+        # Returns the whole bytes, fewer than 8 bits and the current context's table are carried into the next call.
+        next_codes = self.next_codes
+        codes = self.codes
+        payload = bytearray()
+        acc, acc_bits = self.acc, self.acc_bits
+        try:
+            for char in chunk:
+                code, length = codes[char]
+                codes = next_codes[char]
+                acc = (acc << length) | code
+                acc_bits += length
+                if acc_bits >= FLUSH_BITS:
+                    acc, acc_bits = flush_bytes(payload, acc, acc_bits)
+        except KeyError as e:
+            raise HuffmanError(f"the context model has no code for {e.args[0]!r} in this context, the source changed since it was counted") from e
+        self.symbols += len(chunk)
+        self.acc, self.acc_bits = flush_bytes(payload, acc, acc_bits)
+        self.codes = codes
+        return payload
+
+    def finish(self) -> bytes:
+        # the zero padded last byte
+        if not self.acc_bits:
+            return b""
+        last = bytes([self.acc << (8 - self.acc_bits)])
+        self.acc, self.acc_bits = 0, 0
+        return last
+
+
+def context_header(model: ContextModel, pair_counts: Dict[Tuple[str, str], int], flags: int = 0) -> ContainerHeader:
+    # The padding is known up front from the pair counts, like in the order-0 header.
+    return ContainerHeader(table_kind=TABLE_CONTEXT, original_length=sum(pair_counts.values()),
+                           padding_bits=-model.payload_bits(pair_counts) % 8, table=model.to_bytes(), flags=flags)
+
+
+def compress_context(src: TextIO, dst: BinaryIO, chunk_size: int = CHUNK_SIZE, max_code_length: int = None) -> ContextEncoder:
+    # Reads src twice from its current position, once to count the pairs and once to encode, so it must be seekable.
+    if not src.seekable():
+        raise HuffmanError("context mode reads the source twice, it needs a seekable source")
+    start = src.tell()
+    pair_counts: Counter = Counter()
+    with profile_stage("histogram") as stage:
+        previous = START_CONTEXT
+        for chunk in iter(lambda: src.read(chunk_size), ''):
+            previous = count_pairs(chunk, previous, pair_counts)
+        stage.add(symbols=sum(pair_counts.values()))
+    with profile_stage("code table") as stage:
+        model = ContextModel.from_pairs(pair_counts, max_code_length)
+        stage.add(clusters=len(model.tables))
+    src.seek(start)
+    encoder = ContextEncoder(model)
+    with profile_stage("encode") as stage:
+        dst.write(context_header(model, pair_counts).to_bytes())
+        for chunk in iter(lambda: src.read(chunk_size), ''):
+            dst.write(encoder.encode(chunk))
+        dst.write(encoder.finish())
+        stage.add(symbols=encoder.symbol_count())
+    return encoder
+
+
+def compress_context_text(text: str, flags: int = 0, max_code_length: int = None) -> bytes:
+    # In-memory text into a complete container, see compress_text().
+    pair_counts: Counter = Counter()
+    count_pairs(text, START_CONTEXT, pair_counts)
+    model = ContextModel.from_pairs(pair_counts, max_code_length)
+    encoder = ContextEncoder(model)
+    return context_header(model, pair_counts, flags).to_bytes() + encoder.encode(text) + encoder.finish()
@@ -0,0 +1,503 @@
+from typing import List, Tuple, Iterator, BinaryIO
+from contextlib import contextmanager
+import struct
+
+from huffman_profile import profile_stage
+
+# Binary container shared by compression_file.py and decompression_file.py.
+#
+# Layout (all integers are unsigned LEB128 varints unless noted):
+#   magic            4 bytes, b"HUFB"
+#   version          1 byte
+#   table_kind       1 byte, how the code table is serialized (see TABLE_*)
+#   flags            1 byte, optional layout features (see FLAG_*), version 2 and up
+#   original_length  number of symbols in the original text
+#   padding_bits     1 byte, unused low bits in the last payload byte
+#   table_length     byte length of the code table
+#   table            code table bytes
+#   stream_count     only with FLAG_STREAMS, number of interleaved streams per block
+#   payload          packed bitstream, msb first, until the end of the file
+#
+# An appended file (FLAG_SEGMENTS) is a sequence of such containers, its segments, followed by a SegmentIndex.
+MAGIC: bytes = b"HUFB"
+FORMAT_VERSION: int = 2
+SUPPORTED_VERSIONS: List[int] = [1, 2]
+
+# The payload is a sequence of independently encoded, byte aligned blocks sharing the code table.
+# It is followed by a BlockIndex and an 8 byte little-endian footer holding the index offset,
+# padding_bits is unused (every block records its own bit length).
+FLAG_BLOCKS: int = 0x01
+# The payload is followed by a SeekIndex and the same 8 byte footer. Only used without FLAG_BLOCKS,
+# whose block index already allows decoding from the middle of the file.
+FLAG_SEEK_INDEX: int = 0x02
+
+# The original input was bytes holding UTF-8 text rather than str, the in-memory decode() gives bytes back.
+FLAG_BYTES: int = 0x04
+# Only with FLAG_BLOCKS: every block is K interleaved, byte aligned bitstreams, K is stream_count in the header.
+# Symbol i of a block is in stream i % K. The block index has K consecutive entries per block, one per stream,
+# so the streams of a block decode independently of each other.
+FLAG_STREAMS: int = 0x08
+# The container is the first segment of an appended file: more containers follow it, then a SegmentIndex and
+# the 8 byte footer. Set only in the first header, in place, by the first append.
+FLAG_SEGMENTS: int = 0x10
+# Byte offset of the flags in the header, where an append sets FLAG_SEGMENTS.
+FLAGS_OFFSET: int = len(MAGIC) + 2
+
+# Trailing index offset written after the block index, the seek index or the segment index.
+FOOTER: struct.Struct = struct.Struct("<Q")
+
+# Number of characters (or compressed bytes when decoding) read per step when streaming, bounds the memory of every pass.
+CHUNK_SIZE: int = 1 << 16
+# Pending bits in an encoder's integer accumulator before whole bytes are flushed, keeps the integer small.
+FLUSH_BITS: int = 128
+
+# Preorder tree shape: varint leaf count, varint symbol byte length, one shape bit per node
+# (1 = leaf, 0 = internal, packed msb first) and the leaf symbols in preorder as UTF-8.
+TABLE_TREE: int = 0
+# Canonical code lengths: 1 byte max length, varint symbol count per length (1..max length),
+# varint symbol byte length and the symbols in canonical order as UTF-8.
+TABLE_CANONICAL: int = 1
+# The table is the 8 byte id of a pre-trained model (see huffman_model.py) holding the canonical code table.
+TABLE_MODEL: int = 2
+# No table, the code adapts as the text is decoded (see huffman_adaptive.py). The payload ends with an end marker,
+# original_length and padding_bits are unused.
+TABLE_ADAPTIVE: int = 3
+# Byte symbols: the same layout as TABLE_CANONICAL but the symbols are raw byte values, one byte each,
+# and original_length counts bytes. The original is any binary file, decoding gives it back byte for byte.
+TABLE_BYTES: int = 4
+# Only in an appended segment: no table, the segment uses the code table of the segment before it.
+TABLE_PREVIOUS: int = 5
+# Order-1 context model (see huffman_context.py): one canonical table per cluster of previous characters
+# and the cluster of every context that has a table of its own.
+TABLE_CONTEXT: int = 6
+
+
+class HuffmanError(ValueError):
+    # Raised for invalid input, options or compressed data, so callers can catch one exception type.
+    pass
+
+
+@contextmanager
+def corrupt_data_errors() -> Iterator[None]:
+    # Wraps the decoding entry points (HuffmanCodec.decode(), decompress_file() and friends): whatever corrupt data
+    # still breaks deeper down is raised as HuffmanError, so callers catch one exception type.
+    try:
+        yield
+    except HuffmanError:
+        raise
+    except (ValueError, IndexError, KeyError, OverflowError, MemoryError, EOFError, struct.error) as e:
+        raise HuffmanError(f"the compressed data is corrupt ({type(e).__name__}: {e})") from e
+
+
+def parse_int_option(arg: str) -> int:
+    # the value of a --name=N command line option
+    name, value = arg.split("=", 1)
+    try:
+        return int(value)
+    except ValueError:
+        raise HuffmanError(f"{name} takes a whole number, got {value!r}") from None
+
+
+def flush_bytes(payload: bytearray, acc: int, acc_bits: int) -> Tuple[int, int]:
+    # Appends the whole bytes of the msb first accumulator to payload, returns the accumulator of the fewer than 8 bits left.
+    rest = acc_bits & 7
+    if acc_bits > rest:
+        payload += (acc >> rest).to_bytes((acc_bits - rest) >> 3, 'big')
+        acc &= (1 << rest) - 1
+    return acc, rest
+
+
+def write_varint(buffer: bytearray, value: int) -> None:
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            buffer.append(byte | 0x80)
+        else:
+            buffer.append(byte)
+            return
+
+
+def read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    # returns (value, position after the varint)
+    value: int = 0
+    shift: int = 0
+    while True:
+        if pos >= len(data):
+            raise HuffmanError("truncated varint")
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def read_varint_fd(fd: BinaryIO) -> int:
+    value: int = 0
+    shift: int = 0
+    while True:
+        byte = fd.read(1)
+        if not byte:
+            raise HuffmanError("truncated varint")
+        value |= (byte[0] & 0x7F) << shift
+        if not byte[0] & 0x80:
+            return value
+        shift += 7
+
+
+def read_exact(fd: BinaryIO, size: int) -> bytes:
+    data = fd.read(size)
+    if len(data) != size:
+        raise HuffmanError(f"truncated header, expected {size} bytes and got {len(data)}")
+    return data
+
+
+def pack_bits(bits: List[int]) -> bytes:
+    packed = bytearray((len(bits) + 7) // 8)
+    for i, bit in enumerate(bits):
+        if bit:
+            packed[i >> 3] |= 0x80 >> (i & 7)
+    return bytes(packed)
+
+
+def unpack_bits(packed: bytes, count: int) -> List[int]:
+    if len(packed) < (count + 7) // 8:
+        raise HuffmanError(f"{count} bits don't fit in {len(packed)} bytes, the data is corrupt")
+    return [(packed[i >> 3] >> (7 - (i & 7))) & 1 for i in range(count)]
+
+
+def pack_tree_table(shape: List[int], symbols: str) -> bytes:
+    # shape is the preorder list of is-leaf flags, symbols the leaf characters in the same order
+    symbol_bytes = symbols.encode('utf-8')
+    table = bytearray()
+    write_varint(table, len(symbols))
+    write_varint(table, len(symbol_bytes))
+    table += pack_bits(shape)
+    table += symbol_bytes
+    return bytes(table)
+
+
+def unpack_tree_table(table: bytes) -> Tuple[List[int], str]:
+    leaf_count, pos = read_varint(table, 0)
+    symbol_byte_len, pos = read_varint(table, pos)
+    node_count = 2 * leaf_count - 1
+    shape_len = (node_count + 7) // 8
+    shape = unpack_bits(table[pos:pos + shape_len], node_count)
+    pos += shape_len
+    symbols = decode_symbols(table[pos:pos + symbol_byte_len])
+    if len(symbols) != leaf_count:
+        raise HuffmanError(f"tree table has {len(symbols)} symbols for {leaf_count} leaves, the data is corrupt")
+    return shape, symbols
+
+
+def decode_symbols(symbol_bytes: bytes) -> str:
+    # the UTF-8 symbols of a code table
+    try:
+        return symbol_bytes.decode('utf-8')
+    except UnicodeDecodeError as e:
+        raise HuffmanError(f"the code table symbols aren't UTF-8, the data is corrupt: {e}") from e
+
+
+def pack_code_lengths(lengths: List[int], symbol_bytes: bytes) -> bytes:
+    # lengths are the code lengths in canonical order, symbol_bytes the serialized symbols in the same order
+    max_length = lengths[-1] if lengths else 0
+    counts = [0] * (max_length + 1)
+    for length in lengths:
+        counts[length] += 1
+    table = bytearray([max_length])
+    for count in counts[1:]:
+        write_varint(table, count)
+    write_varint(table, len(symbol_bytes))
+    table += symbol_bytes
+    return bytes(table)
+
+
+def unpack_code_lengths(table: bytes) -> Tuple[List[int], bytes]:
+    # returns the code lengths in canonical order and the serialized symbols
+    if not table:
+        raise HuffmanError("the code table is empty, the data is corrupt")
+    max_length = table[0]
+    pos = 1
+    lengths: List[int] = list()
+    for length in range(1, max_length + 1):
+        count, pos = read_varint(table, pos)
+        # every symbol takes at least one byte of the table, and there are only 2^length codes of a length
+        if len(lengths) + count > len(table) - pos or count > 1 << length:
+            raise HuffmanError(f"the code table has {count} codes of length {length}, more than it can hold, the data is corrupt")
+        lengths += [length] * count
+    symbol_byte_len, pos = read_varint(table, pos)
+    if symbol_byte_len > len(table) - pos:
+        raise HuffmanError(f"the code table is truncated, {symbol_byte_len} symbol bytes announced and {len(table) - pos} left")
+    return lengths, table[pos:pos + symbol_byte_len]
+
+
+def pack_canonical_table(ordered: List[Tuple[str, int]]) -> bytes:
+    # ordered is the list of (symbol, code length) pairs in canonical order
+    return pack_code_lengths([length for _, length in ordered], ''.join(symbol for symbol, _ in ordered).encode('utf-8'))
+
+
+def unpack_canonical_table(table: bytes) -> List[Tuple[str, int]]:
+    lengths, symbol_bytes = unpack_code_lengths(table)
+    symbols = decode_symbols(symbol_bytes)
+    if len(symbols) != len(lengths):
+        raise HuffmanError(f"canonical table has {len(symbols)} symbols for {len(lengths)} code lengths")
+    return list(zip(symbols, lengths))
+
+
+def pack_byte_table(ordered: List[Tuple[int, int]]) -> bytes:
+    # ordered is the list of (byte value, code length) pairs in canonical order
+    return pack_code_lengths([length for _, length in ordered], bytes(symbol for symbol, _ in ordered))
+
+
+def unpack_byte_table(table: bytes) -> List[Tuple[int, int]]:
+    lengths, symbol_bytes = unpack_code_lengths(table)
+    if len(symbol_bytes) != len(lengths):
+        raise HuffmanError(f"byte table has {len(symbol_bytes)} symbols for {len(lengths)} code lengths")
+    return list(zip(symbol_bytes, lengths))
+
+
+class ContainerHeader:
+    def __init__(self, table_kind: int, original_length: int, padding_bits: int, table: bytes, flags: int = 0, version: int = FORMAT_VERSION,
+                 stream_count: int = 1) -> None:
+        self.version: int = version
+        self.table_kind: int = table_kind
+        self.flags: int = flags
+        self.original_length: int = original_length
+        self.padding_bits: int = padding_bits
+        self.table: bytes = table
+        self.stream_count: int = stream_count     # streams per block, more than 1 only with FLAG_STREAMS
+
+    def __repr__(self) -> str:
+        return (f"ContainerHeader(version={self.version}, table_kind={self.table_kind}, flags={self.flags}, "
+                f"original_length={self.original_length}, padding_bits={self.padding_bits}, table_len={len(self.table)})")
+
+    def to_bytes(self) -> bytes:
+        with profile_stage("write header") as stage:
+            header = bytearray(MAGIC)
+            header.append(self.version)
+            header.append(self.table_kind)
+            header.append(self.flags)
+            write_varint(header, self.original_length)
+            header.append(self.padding_bits)
+            write_varint(header, len(self.table))
+            header += self.table
+            if self.flags & FLAG_STREAMS:
+                write_varint(header, self.stream_count)
+            stage.add(bytes_out=len(header), table_bytes=len(self.table))
+        return bytes(header)
+
+    @classmethod
+    def from_fd(cls, fd: BinaryIO) -> "ContainerHeader":
+        with profile_stage("read header") as stage:
+            magic = fd.read(len(MAGIC))
+            if magic != MAGIC:
+                raise HuffmanError(f"not a Huffman container, magic = {magic!r}")
+            version, table_kind = read_exact(fd, 2)
+            if version not in SUPPORTED_VERSIONS:
+                raise HuffmanError(f"unsupported container version = {version}")
+            flags = read_exact(fd, 1)[0] if version >= 2 else 0
+            original_length = read_varint_fd(fd)
+            padding_bits = read_exact(fd, 1)[0]
+            if padding_bits > 7:
+                raise HuffmanError(f"padding_bits = {padding_bits}, the last byte has at most 7 unused bits")
+            table_len = read_varint_fd(fd)
+            table = read_exact(fd, table_len)
+            stream_count = read_varint_fd(fd) if flags & FLAG_STREAMS else 1
+            if stream_count == 0 or (flags & FLAG_STREAMS and not flags & FLAG_BLOCKS):
+                raise HuffmanError(f"{stream_count} interleaved streams with flags = {flags}, the data is corrupt")
+            stage.add(table_bytes=table_len)
+        return cls(table_kind=table_kind, original_length=original_length, padding_bits=padding_bits, table=table, flags=flags, version=version,
+                   stream_count=stream_count)
+
+
+def write_footer(fd: BinaryIO, index_offset: int) -> None:
+    fd.write(FOOTER.pack(index_offset))
+
+
+def read_footer(fd: BinaryIO) -> Tuple[int, int]:
+    # returns (index offset, footer offset), the payload ends where the index starts
+    footer_offset = fd.seek(0, 2) - FOOTER.size
+    if footer_offset < 0:
+        raise HuffmanError("the file is too short for its index footer, the data is truncated")
+    fd.seek(footer_offset)
+    (index_offset,) = FOOTER.unpack(fd.read(FOOTER.size))
+    if index_offset > footer_offset:
+        raise HuffmanError(f"index offset {index_offset} is past the end of the file, the data is corrupt")
+    return index_offset, footer_offset
+
+
+class BlockIndex:
+    # Per block symbol count and bit length, the byte offset of every block follows from the bit lengths.
+    def __init__(self, symbol_counts: List[int] = None, bit_lengths: List[int] = None) -> None:
+        self.symbol_counts: List[int] = symbol_counts if symbol_counts is not None else list()
+        self.bit_lengths: List[int] = bit_lengths if bit_lengths is not None else list()
+
+    def __len__(self) -> int:
+        return len(self.bit_lengths)
+
+    def append(self, symbol_count: int, bit_length: int) -> None:
+        self.symbol_counts.append(symbol_count)
+        self.bit_lengths.append(bit_length)
+
+    def offsets(self) -> List[int]:
+        # byte offset of every block relative to the start of the payload
+        offsets: List[int] = list()
+        offset: int = 0
+        for bit_length in self.bit_lengths:
+            offsets.append(offset)
+            offset += (bit_length + 7) >> 3
+        return offsets
+
+    def blocks(self, stream_count: int = 1) -> List[Tuple[int, int, List[int]]]:
+        # (byte offset, symbol count, bit length of every stream) per block, a block has stream_count consecutive entries
+        if len(self) % stream_count:
+            raise HuffmanError(f"{len(self)} block index entries aren't whole blocks of {stream_count} streams, the data is corrupt")
+        offsets = self.offsets()
+        return [(offsets[i], sum(self.symbol_counts[i:i + stream_count]), self.bit_lengths[i:i + stream_count])
+                for i in range(0, len(self), stream_count)]
+
+    def to_bytes(self) -> bytes:
+        index = bytearray()
+        write_varint(index, len(self))
+        for symbol_count, bit_length in zip(self.symbol_counts, self.bit_lengths):
+            write_varint(index, symbol_count)
+            write_varint(index, bit_length)
+        return bytes(index)
+
+    @classmethod
+    def from_bytes(cls, index: bytes) -> "BlockIndex":
+        block_index = cls()
+        block_count, pos = read_varint(index, 0)
+        for _ in range(block_count):
+            symbol_count, pos = read_varint(index, pos)
+            bit_length, pos = read_varint(index, pos)
+            block_index.append(symbol_count, bit_length)
+        return block_index
+
+    def write_with_footer(self, fd: BinaryIO) -> None:
+        index_offset = fd.tell()
+        fd.write(self.to_bytes())
+        write_footer(fd, index_offset)
+
+    @classmethod
+    def from_footer(cls, fd: BinaryIO) -> Tuple["BlockIndex", int]:
+        # returns the index and its offset in the file, which is also where the payload ends
+        index_offset, footer_offset = read_footer(fd)
+        fd.seek(index_offset)
+        return cls.from_bytes(fd.read(footer_offset - index_offset)), index_offset
+
+
+class SeekIndex:
+    # Checkpoint i is the payload bit offset where the code of character i * interval starts. Checkpoints sit on
+    # code boundaries, so decoding always resumes from the root of the tree and no tree state needs storing.
+    # Entries are fixed width, so a lookup reads one entry no matter how large the file is.
+    HEADER: struct.Struct = struct.Struct("<QQ")    # interval, checkpoint count
+    ENTRY: struct.Struct = struct.Struct("<Q")      # bit offset
+
+    def __init__(self, interval: int, bit_offsets: List[int] = None) -> None:
+        self.interval: int = interval
+        self.bit_offsets: List[int] = bit_offsets if bit_offsets is not None else list()
+
+    def __len__(self) -> int:
+        return len(self.bit_offsets)
+
+    def append(self, bit_offset: int) -> None:
+        self.bit_offsets.append(bit_offset)
+
+    def write_with_footer(self, fd: BinaryIO) -> None:
+        index_offset = fd.tell()
+        fd.write(self.HEADER.pack(self.interval, len(self)))
+        fd.write(b"".join(self.ENTRY.pack(bit_offset) for bit_offset in self.bit_offsets))
+        write_footer(fd, index_offset)
+
+    @classmethod
+    def lookup(cls, fd: BinaryIO, position: int) -> Tuple[int, int, int]:
+        # Returns (bit offset, decoded offset) of the last checkpoint at or before character `position`,
+        # plus the index offset, where the payload ends.
+        index_offset, _ = read_footer(fd)
+        fd.seek(index_offset)
+        entries = fd.read(cls.HEADER.size)
+        if len(entries) != cls.HEADER.size:
+            raise HuffmanError("the seek index is truncated")
+        interval, count = cls.HEADER.unpack(entries)
+        if interval == 0 or count == 0 or index_offset + cls.HEADER.size + count * cls.ENTRY.size > fd.seek(0, 2):
+            raise HuffmanError(f"seek index with interval {interval} and {count} checkpoints, the data is corrupt")
+        checkpoint = min(position // interval, count - 1)
+        fd.seek(index_offset + cls.HEADER.size + checkpoint * cls.ENTRY.size)
+        (bit_offset,) = cls.ENTRY.unpack(fd.read(cls.ENTRY.size))
+        return bit_offset, checkpoint * interval, index_offset
+
+
+class SegmentIndex:
+    # Byte offset of every segment of an appended file, relative to the start of the first segment.
+    # Written after the last segment with the 8 byte footer, and rewritten by every append.
+    def __init__(self, offsets: List[int] = None) -> None:
+        self.offsets: List[int] = offsets if offsets is not None else list()
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def append(self, offset: int) -> None:
+        self.offsets.append(offset)
+
+    def bounds(self, end: int) -> List[Tuple[int, int]]:
+        # (start, end) of every segment, the last one ends at `end`, where the index starts
+        return list(zip(self.offsets, self.offsets[1:] + [end]))
+
+    def to_bytes(self) -> bytes:
+        index = bytearray()
+        write_varint(index, len(self))
+        for offset in self.offsets:
+            write_varint(index, offset)
+        return bytes(index)
+
+    def write_with_footer(self, fd: BinaryIO, base: int = 0) -> None:
+        index_offset = fd.tell()
+        fd.write(self.to_bytes())
+        write_footer(fd, index_offset - base)
+
+    @classmethod
+    def read(cls, fd: BinaryIO, base: int = 0) -> Tuple["SegmentIndex", int]:
+        # Returns the index and its offset, which is where the last segment ends. Leaves fd at an unspecified position.
+        index_offset, footer_offset = read_footer(fd)
+        if not 0 <= base + index_offset <= footer_offset:
+            raise HuffmanError(f"segment index offset {index_offset} is out of the file, the data is corrupt")
+        fd.seek(base + index_offset)
+        segment_index = cls()
+        for _ in range(read_varint_fd(fd)):
+            segment_index.append(read_varint_fd(fd))
+        if not segment_index.offsets or segment_index.offsets != sorted(segment_index.offsets) or segment_index.offsets[-1] > index_offset:
+            raise HuffmanError("the segment index is out of order, the data is corrupt")
+        return segment_index, index_offset
+
+
+class SegmentFile:
+    # Read-only view of bytes [start, end) of fd as a file of its own, so a segment decodes like a whole container:
+    # its payload ends, and its footer is found, at the end of the segment instead of the end of the file.
+    def __init__(self, fd: BinaryIO, start: int, end: int) -> None:
+        self.fd: BinaryIO = fd
+        self.start: int = start
+        self.size: int = end - start
+        self.pos: int = 0
+
+    def read(self, size: int = -1) -> bytes:
+        remaining = max(self.size - self.pos, 0)
+        size = remaining if size is None or size < 0 else min(size, remaining)
+        self.fd.seek(self.start + self.pos)
+        data = self.fd.read(size)
+        self.pos += len(data)
+        return data
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        base = (0, self.pos, self.size)[whence]
+        if base + offset < 0:
+            raise HuffmanError(f"seek before the start of the segment, offset = {offset}")
+        self.pos = base + offset
+        return self.pos
+
+    def tell(self) -> int:
+        return self.pos
+
+    def seekable(self) -> bool:
+        return True
@@ -0,0 +1,150 @@
+from typing import Dict, List, Tuple
+from collections import Counter
+import codecs
+import mmap
+import os
+
+from huffman_format import HuffmanError
+from huffman_parallel import ordered_map, default_workers
+from huffman_profile import profile_stage
+
+# Character histogram of a UTF-8 text file, counted with C-level primitives instead of a per character loop.
+# The counts follow text mode reading with universal newlines ("\r\n" and "\r" count as "\n"),
+# the same way HuffmanEncoder reads the file when it encodes it.
+#
+# Chunks are decoded and counted with collections.Counter, or, when NumPy is installed and the chunk is ASCII,
+# counted as bytes with numpy.bincount. Files larger than PARALLEL_MIN_SIZE are split
+# into byte ranges on character boundaries, counted by worker processes and the partial histograms are merged.
+#
+# byte_histogram() counts raw bytes for the byte symbol mode, no decoding and no newline translation,
+# into a list of 256 counts indexed by byte value.
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Bytes counted per step inside a range.
+HISTOGRAM_CHUNK_SIZE: int = 1 << 22
+# Files smaller than this are counted in this process, a pool costs more than it saves.
+PARALLEL_MIN_SIZE: int = 1 << 24
+
+
+def count_ascii(data: bytes) -> Counter:
+    # histogram of an ASCII chunk keyed by character, needs NumPy
+    counts = numpy.bincount(numpy.frombuffer(data, dtype=numpy.uint8), minlength=128)
+    return Counter({chr(byte): int(count) for byte, count in enumerate(counts) if count})
+
+
+def count_range(task: Tuple[str, int, int]) -> Tuple[Counter, int, bool, bool]:
+    # Counts the characters of bytes [start, end) of the file. Returns the raw histogram, the number of "\r\n"
+    # pairs inside the range, and whether the range starts with "\n" / ends with "\r" to fix pairs across ranges.
+    path, start, end = task
+    histogram: Counter = Counter()
+    crlf_pairs: int = 0
+    if start >= end:
+        return histogram, 0, False, False
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        with open(path, 'rb') as fd, mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+            starts_with_lf: bool = view[start] == 0x0A
+            ends_with_cr: bool = view[end - 1] == 0x0D
+            prev_cr: bool = False
+            for offset in range(start, end, HISTOGRAM_CHUNK_SIZE):
+                with view[offset:min(offset + HISTOGRAM_CHUNK_SIZE, end)] as chunk:
+                    if prev_cr and chunk[0] == 0x0A:
+                        crlf_pairs += 1
+                    prev_cr = chunk[-1] == 0x0D
+                    # the chunk is only copied out of the mapping for the ASCII check of the NumPy path
+                    data = bytes(chunk) if numpy is not None and not decoder.getstate()[0] else None
+                    if data is not None and data.isascii():
+                        histogram.update(count_ascii(data))
+                        crlf_pairs += data.count(b'\r\n')
+                    else:
+                        text = decoder.decode(chunk)
+                        histogram.update(text)
+                        crlf_pairs += text.count('\r\n')
+            histogram.update(decoder.decode(b'', final=True))
+    except UnicodeDecodeError as e:
+        raise HuffmanError(f"{path} isn't UTF-8 text ({e}), compress it with byte symbols") from e
+    return histogram, crlf_pairs, starts_with_lf, ends_with_cr
+
+
+def split_ranges(path: str, parts: int) -> List[Tuple[str, int, int]]:
+    # Cuts the file into `parts` byte ranges whose boundaries never split a UTF-8 character.
+    size = os.path.getsize(path)
+    bounds: List[int] = [0]
+    with open(path, 'rb') as fd:
+        for i in range(1, parts):
+            pos = max(size * i // parts, bounds[-1])
+            fd.seek(pos)
+            while pos < size and (fd.read(1)[0] & 0xC0) == 0x80:   # skip UTF-8 continuation bytes
+                pos += 1
+            bounds.append(min(pos, size))
+    bounds.append(size)
+    return [(path, bounds[i], bounds[i + 1]) for i in range(parts)]
+
+
+def char_histogram(path: str, workers: int = None) -> Dict[str, int]:
+    if workers is None:
+        workers = default_workers()
+    size = os.path.getsize(path)
+    if size == 0:
+        return dict()
+    parts = workers if size >= PARALLEL_MIN_SIZE and workers > 1 else 1
+    histogram: Counter = Counter()
+    crlf_pairs: int = 0
+    prev_ends_with_cr: bool = False
+    with profile_stage("histogram") as stage:
+        for part_histogram, part_crlf_pairs, starts_with_lf, ends_with_cr in ordered_map(count_range, split_ranges(path, parts), workers=parts):
+            histogram.update(part_histogram)
+            crlf_pairs += part_crlf_pairs
+            if prev_ends_with_cr and starts_with_lf:
+                crlf_pairs += 1
+            prev_ends_with_cr = ends_with_cr
+        # universal newlines: every "\r\n" pair and every lone "\r" reads as a single "\n"
+        carriage_returns = histogram.pop('\r', 0)
+        if carriage_returns:
+            histogram['\n'] += carriage_returns - crlf_pairs
+        char_counts: Dict[str, int] = {char: count for char, count in histogram.items() if count > 0}
+        stage.add(bytes_in=size, symbols=sum(char_counts.values()))
+    return char_counts
+
+
+def count_bytes(data: bytes) -> List[int]:
+    # 256 counts indexed by byte value, data is any bytes-like object
+    if numpy is not None:
+        return numpy.bincount(numpy.frombuffer(data, dtype=numpy.uint8), minlength=256).tolist()
+    counts: List[int] = [0] * 256
+    for byte, count in Counter(memoryview(data).cast('B')).items():
+        counts[byte] = count
+    return counts
+
+
+def count_byte_range(task: Tuple[str, int, int]) -> List[int]:
+    # Counts the bytes [start, end) of the file through a memoryview of the mapped file, no copies.
+    path, start, end = task
+    counts: List[int] = [0] * 256
+    with open(path, 'rb') as fd, mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+        for offset in range(start, end, HISTOGRAM_CHUNK_SIZE):
+            with view[offset:min(offset + HISTOGRAM_CHUNK_SIZE, end)] as chunk:
+                for byte, count in enumerate(count_bytes(chunk)):
+                    counts[byte] += count
+    return counts
+
+
+def byte_histogram(path: str, workers: int = None) -> List[int]:
+    if workers is None:
+        workers = default_workers()
+    size = os.path.getsize(path)
+    counts: List[int] = [0] * 256
+    if size == 0:
+        return counts
+    parts = workers if size >= PARALLEL_MIN_SIZE and workers > 1 else 1
+    tasks = [(path, size * i // parts, size * (i + 1) // parts) for i in range(parts)]
+    with profile_stage("histogram") as stage:
+        for part_counts in ordered_map(count_byte_range, tasks, workers=parts):
+            for byte, count in enumerate(part_counts):
+                counts[byte] += count
+        stage.add(bytes_in=size, symbols=size)
+    return counts
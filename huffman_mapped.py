@@ -0,0 +1,82 @@
+from typing import Iterator, Union
+from contextlib import contextmanager
+import codecs
+import mmap
+import io
+import os
+
+from huffman_format import HuffmanError
+
+# Memory-mapped file access for the encoder and the decoder. The file is mapped once and read through memoryview
+# slices of the mapping, so the OS pages it in on demand and nothing is copied into Python buffers until a chunk
+# is actually decoded. Empty files can't be mapped, they give an empty view.
+
+
+@contextmanager
+def map_file(path: str) -> Iterator[memoryview]:
+    # read-only view of the whole file, released when the block exits
+    with open(path, 'rb') as fd:
+        if os.fstat(fd.fileno()).st_size == 0:
+            yield memoryview(b"")
+            return
+        with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+            yield view
+
+
+class MappedSource:
+    # File-like reader over a mapped file for HuffmanEncoder. In text mode read(size) decodes at most `size`
+    # characters of UTF-8 with universal newlines, the same characters open(path, 'r') gives. In bytes mode
+    # read(size) returns memoryview slices of the mapping, without copies.
+    def __init__(self, view: memoryview, text: bool = True) -> None:
+        self.view: memoryview = view
+        self.text: bool = text
+        self.pos: int = 0           # byte offset of the next undecoded byte
+        self.pending: str = ""      # decoded characters not returned yet
+        self.decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder('utf-8')(), translate=True) if text is True else None
+
+    def read(self, size: int) -> Union[str, memoryview]:
+        if self.text is False:
+            chunk = self.view[self.pos:self.pos + size]
+            self.pos += len(chunk)
+            return chunk
+        while len(self.pending) < size and self.pos < len(self.view):
+            # a UTF-8 character is at least one byte, so `size` bytes never decode to more than `size` characters
+            end = min(self.pos + max(size, 1 << 12), len(self.view))
+            self.pending += self.decoder.decode(self.view[self.pos:end], final=end == len(self.view))
+            self.pos = end
+        text, self.pending = self.pending[:size], self.pending[size:]
+        return text
+
+
+class MappedWriter:
+    # Text sink writing into an output file preallocated to its final `size` in bytes and mapped for writing,
+    # for when the decoded size is known from the header. close() checks that exactly `size` bytes were written.
+    def __init__(self, path: str, size: int, encoding: str = 'utf-8') -> None:
+        self.path: str = path
+        self.size: int = size
+        self.encoding: str = encoding
+        self.pos: int = 0
+        self.fd = open(path, 'w+b')
+        self.fd.truncate(size)
+        self.mapped: mmap.mmap = mmap.mmap(self.fd.fileno(), size) if size else None
+
+    def __enter__(self) -> "MappedWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        self.close(check=exc_type is None)
+
+    def write(self, text: str) -> None:
+        data = text.encode(self.encoding)
+        end = self.pos + len(data)
+        if end > self.size:
+            raise HuffmanError(f"decoded more than the {self.size} bytes the header says, the data is corrupt")
+        self.mapped[self.pos:end] = data
+        self.pos = end
+
+    def close(self, check: bool = True) -> None:
+        if self.mapped is not None:
+            self.mapped.close()
+        self.fd.close()
+        if check is True and self.pos != self.size:
+            raise HuffmanError(f"decoded {self.pos} bytes, the header says {self.size}, the data is corrupt")
@@ -0,0 +1,61 @@
+from typing import List, Dict, Tuple
+import hashlib
+import os
+
+from huffman_format import HuffmanError, pack_canonical_table, unpack_canonical_table
+from huffman_codes import canonical_codes
+
+# Pre-trained code tables ("models") for compressing many small, similarly distributed messages.
+# A model is a canonical code table trained on a sample corpus. Messages compressed against it carry only the
+# model id (TABLE_MODEL) instead of their own table. The id is derived from the table itself, so the same
+# training always gives the same id.
+#
+# Model file layout: magic b"HUFM", 1 byte version, 8 byte model id, canonical table (see pack_canonical_table()).
+MODEL_MAGIC: bytes = b"HUFM"
+MODEL_VERSION: int = 1
+MODEL_ID_SIZE: int = 8
+MODEL_EXTENSION: str = ".hufm"
+
+
+class HuffmanModel:
+    def __init__(self, ordered: List[Tuple[str, int]]) -> None:
+        self.ordered: List[Tuple[str, int]] = ordered     # (symbol, code length) in canonical order
+        self.table: bytes = pack_canonical_table(ordered)
+        self.model_id: bytes = hashlib.sha256(self.table).digest()[:MODEL_ID_SIZE]
+        self.symbols: frozenset = frozenset(symbol for symbol, _ in ordered)
+        self.codes: Dict[str, Tuple[int, int]] = canonical_codes(ordered)     # symbol -> (code, length)
+
+    def __repr__(self) -> str:
+        return f"HuffmanModel(model_id={self.model_id.hex()}, symbols={len(self.ordered)})"
+
+    def covers(self, text: str) -> bool:
+        # True when every character of text has a code in this model
+        return self.symbols.issuperset(text)
+
+    @staticmethod
+    def file_name(model_id: bytes) -> str:
+        return f"{model_id.hex()}{MODEL_EXTENSION}"
+
+    def save(self, directory: str) -> str:
+        path = os.path.join(directory, self.file_name(self.model_id))
+        with open(file=path, mode='wb') as fd:
+            fd.write(MODEL_MAGIC)
+            fd.write(bytes([MODEL_VERSION]))
+            fd.write(self.model_id)
+            fd.write(self.table)
+        return path
+
+    @classmethod
+    def load(cls, path: str) -> "HuffmanModel":
+        with open(file=path, mode='rb') as fd:
+            content = fd.read()
+        if content[:len(MODEL_MAGIC)] != MODEL_MAGIC:
+            raise HuffmanError(f"not a Huffman model file = {path}")
+        pos = len(MODEL_MAGIC)
+        if content[pos] != MODEL_VERSION:
+            raise HuffmanError(f"unsupported model version = {content[pos]}")
+        model_id = content[pos + 1:pos + 1 + MODEL_ID_SIZE]
+        model = cls(unpack_canonical_table(content[pos + 1 + MODEL_ID_SIZE:]))
+        if model.model_id != model_id:
+            raise HuffmanError(f"model file {path} is corrupt, id {model_id.hex()} doesn't match its table")
+        return model
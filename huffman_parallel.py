@@ -0,0 +1,34 @@
+from typing import Any, Callable, Iterable, Iterator, Tuple
+from concurrent.futures import Future, ProcessPoolExecutor
+from collections import deque
+import os
+
+# Process pool helpers shared by the block encoder and decoder.
+
+
+def default_workers() -> int:
+    return os.cpu_count() or 1
+
+
+def ordered_map(fn: Callable, items: Iterable, workers: int = None, initializer: Callable = None,
+                initargs: Tuple = (), window: int = None) -> Iterator[Any]:
+    # Like map(), but fn runs in a pool of worker processes. Results come back in input order, and at most
+    # `window` items are in flight, so the input is consumed lazily and memory stays bounded.
+    # With one worker everything runs in this process, without a pool.
+    if workers is None:
+        workers = default_workers()
+    if workers <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        yield from map(fn, items)
+        return
+    if window is None:
+        window = 2 * workers
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as pool:
+        pending: deque[Future] = deque()
+        for item in items:
+            pending.append(pool.submit(fn, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
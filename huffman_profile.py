@@ -0,0 +1,132 @@
+from typing import Callable, Dict, List, Iterator, Union
+from contextlib import contextmanager
+from time import perf_counter
+import json
+import sys
+
+# Per-stage timers and counters of the codec. The instrumented code opens a stage with
+#
+#   with profile_stage("encode") as stage:
+#       ...
+#       stage.add(symbols=count, bits=bits)
+#
+# Stages are whole passes (histogram, tree, code table, header, encode/decode loop), never single symbols.
+# Nothing is measured until a Profiler is made active with profiling(); until then profile_stage() returns a shared
+# no-op stage and costs one global lookup. The active Profiler is process wide: worker processes (block mode,
+# parallel histograms) aren't measured, their time is part of the stage that waits for them.
+#
+# Stages nest, "seconds" includes the stages opened inside a stage and "self_seconds" doesn't.
+# A stage opened again inside itself (e.g. the adaptive decoder inside "decode") counts once.
+# An optional sink is called with (stage name, seconds, counters added) every time a stage closes,
+# to forward the measurements to a metrics system.
+
+MetricsSink = Callable[[str, float, Dict[str, int]], None]
+
+
+class StageStats:
+    __slots__ = ("name", "calls", "seconds", "child_seconds", "counters")
+
+    def __init__(self, name: str) -> None:
+        self.name: str = name
+        self.calls: int = 0
+        self.seconds: float = 0.0
+        self.child_seconds: float = 0.0     # time spent in the stages opened inside this one
+        self.counters: Dict[str, int] = dict()
+
+    def __repr__(self) -> str:
+        return f"StageStats(name={self.name}, calls={self.calls}, seconds={self.seconds:.6f}, counters={self.counters})"
+
+    def add(self, **counters: int) -> None:
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def as_dict(self) -> Dict[str, Union[int, float]]:
+        return dict(calls=self.calls, seconds=round(self.seconds, 6), self_seconds=round(self.seconds - self.child_seconds, 6), **self.counters)
+
+
+class NullStage:
+    # what profile_stage() returns while profiling is off
+    __slots__ = ()
+
+    def __enter__(self) -> "NullStage":
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        return None
+
+    def add(self, **counters: int) -> None:
+        return None
+
+
+NULL_STAGE: NullStage = NullStage()
+
+
+class Profiler:
+    def __init__(self, sink: MetricsSink = None) -> None:
+        self.sink: MetricsSink = sink
+        self.stages: Dict[str, StageStats] = dict()     # in the order the stages first opened
+        self.open_stages: List[StageStats] = list()
+
+    def __repr__(self) -> str:
+        return f"Profiler(stages={list(self.stages)})"
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[StageStats]:
+        if name not in self.stages:
+            self.stages[name] = StageStats(name)
+        stats = self.stages[name]
+        if stats in self.open_stages:
+            yield stats
+            return
+        counters_before = dict(stats.counters)
+        self.open_stages.append(stats)
+        start = perf_counter()
+        try:
+            yield stats
+        finally:
+            elapsed = perf_counter() - start
+            self.open_stages.pop()
+            stats.calls += 1
+            stats.seconds += elapsed
+            if self.open_stages:
+                self.open_stages[-1].child_seconds += elapsed
+            if self.sink is not None:
+                self.sink(name, elapsed, {key: value - counters_before.get(key, 0) for key, value in stats.counters.items()
+                                          if value != counters_before.get(key, 0)})
+
+    def report(self) -> Dict[str, Dict[str, Union[int, float]]]:
+        return {name: stats.as_dict() for name, stats in self.stages.items()}
+
+    def to_json(self) -> str:
+        return json.dumps(self.report(), indent=2)
+
+
+# The Profiler measuring the process, None while profiling is off.
+active_profiler: Profiler = None
+
+
+def profile_stage(name: str) -> Union[NullStage, Iterator[StageStats]]:
+    if active_profiler is None:
+        return NULL_STAGE
+    return active_profiler.stage(name)
+
+
+@contextmanager
+def profiling(profiler: Profiler = None) -> Iterator[Profiler]:
+    # Measures everything run inside the block with `profiler` (a new one by default) and gives it back.
+    global active_profiler
+    previous = active_profiler
+    active_profiler = profiler if profiler is not None else Profiler()
+    try:
+        yield active_profiler
+    finally:
+        active_profiler = previous
+
+
+def write_profile(profiler: Profiler, path: str = None) -> None:
+    # the --profile CLI output, to stderr or to the file of --profile=path
+    if path is None:
+        print(profiler.to_json(), file=sys.stderr)
+        return
+    with open(file=path, mode='w', encoding='utf-8') as fd:
+        fd.write(profiler.to_json() + "\n")
@@ -0,0 +1,43 @@
+from typing import Tuple
+import asyncio
+import struct
+
+from huffman_format import HuffmanError
+
+# Wire protocol between huffman_server.py and huffman_client.py.
+#
+# Every request and response is one frame: a fixed header followed by `body_length` body bytes.
+#   body_length   4 bytes little-endian
+#   request_id    4 bytes little-endian, chosen by the client and echoed in the response
+#   code          1 byte, OP_* in a request, STATUS_* in a response
+#   model_id      8 bytes, the trained model to compress against (zeros for none), zeros in responses
+# A connection can have many requests in flight, responses come back as they complete, not in request order.
+FRAME: struct.Struct = struct.Struct("<IIB8s")
+NO_MODEL: bytes = bytes(8)
+# Larger frames are refused, bounds the memory one request can take.
+MAX_BODY: int = 1 << 26
+
+OP_COMPRESS: int = 1        # body is UTF-8 text, the response body is the container
+OP_DECOMPRESS: int = 2      # body is a container, the response body is the UTF-8 text
+OP_STATS: int = 3           # empty body, the response body is the server stats as JSON
+
+STATUS_OK: int = 0
+STATUS_ERROR: int = 1       # the response body is the UTF-8 error message
+
+
+def pack_frame(request_id: int, code: int, body: bytes, model_id: bytes = NO_MODEL) -> bytes:
+    return FRAME.pack(len(body), request_id, code, model_id) + body
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Tuple[int, int, bytes, bytes]:
+    # Returns (request id, code, model id, body), or None when the peer closed the connection between frames.
+    try:
+        header = await reader.readexactly(FRAME.size)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise HuffmanError("connection closed in the middle of a frame header") from e
+        return None
+    body_length, request_id, code, model_id = FRAME.unpack(header)
+    if body_length > MAX_BODY:
+        raise HuffmanError(f"frame body of {body_length} bytes is larger than MAX_BODY = {MAX_BODY}")
+    return request_id, code, model_id, await reader.readexactly(body_length)
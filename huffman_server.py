@@ -0,0 +1,292 @@
+from typing import List, Dict, Tuple, Any
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import deque
+import argparse
+import asyncio
+import json
+import time
+import io
+
+from huffman_format import HuffmanError, ContainerHeader, TABLE_MODEL
+from huffman_codec import HuffmanCodec
+from huffman_parallel import default_workers
+from huffman_protocol import (pack_frame, read_frame, NO_MODEL, OP_COMPRESS, OP_DECOMPRESS, OP_STATS,
+                              STATUS_OK, STATUS_ERROR)
+from decompression_file import ModelStore, check_table_bits, MAX_TABLE_BITS
+
+# Local compression sidecar: an asyncio server (Unix socket or localhost TCP) speaking huffman_protocol.py.
+#
+# Requests go through a bounded queue. When it is full the connection stops being read, so a client that sends
+# faster than the pool can work is slowed down by its socket instead of growing the server's memory.
+# A batcher takes requests off the queue, groups small requests that share a code table (the same trained model,
+# or no model) and sends every group to a worker process as one task, so the pickling and pool round trip
+# is paid once per batch. At most 2 batches per worker are in flight.
+
+# Requests with a larger body are never batched.
+SMALL_REQUEST: int = 1 << 14
+# Most requests per batch.
+BATCH_SIZE: int = 64
+# How long the batcher waits for more requests after the first one of a batch.
+BATCH_DELAY: float = 0.002
+# Most requests waiting for the batcher.
+QUEUE_SIZE: int = 1024
+# Number of latest requests the latency percentiles are computed over.
+LATENCY_WINDOW: int = 10000
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class ServiceRequest:
+    def __init__(self, request_id: int, op: int, model_id: bytes, body: bytes, writer: asyncio.StreamWriter, received: float) -> None:
+        self.request_id: int = request_id
+        self.op: int = op
+        self.model_id: bytes = model_id
+        self.body: bytes = body
+        self.writer: asyncio.StreamWriter = writer
+        self.received: float = received
+        self.batch_key: Tuple[int, bytes] = None    # created by: HuffmanService.batch_key()
+
+
+class ServiceStats:
+    def __init__(self) -> None:
+        self.started: float = time.monotonic()
+        self.latencies: deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.requests: int = 0
+        self.errors: int = 0
+        self.batches: int = 0
+        self.bytes_in: int = 0
+        self.bytes_out: int = 0
+
+    def record(self, latency: float, bytes_in: int, bytes_out: int, ok: bool) -> None:
+        self.latencies.append(latency)
+        self.requests += 1
+        self.errors += 0 if ok else 1
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+
+    def snapshot(self) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self.started
+        latencies = list(self.latencies)
+        p50, p99 = percentile(latencies, 0.50), percentile(latencies, 0.99)
+        return {
+            "uptime_s": round(elapsed, 3),
+            "requests": self.requests,
+            "errors": self.errors,
+            "batches": self.batches,
+            "mean_batch_size": round(self.requests / self.batches, 2) if self.batches else None,
+            "p50_ms": round(1000 * p50, 3) if p50 is not None else None,
+            "p99_ms": round(1000 * p99, 3) if p99 is not None else None,
+            "requests_per_s": round(self.requests / elapsed, 1),
+            "mb_in_per_s": round(self.bytes_in / 1e6 / elapsed, 3),
+        }
+
+
+# Per worker process state, set up once by init_service_worker().
+service_store: ModelStore = None
+service_codecs: Dict[bytes, HuffmanCodec] = dict()
+
+def init_service_worker(model_dir: str, table_bits: int) -> None:
+    global service_store
+    service_store = ModelStore(model_dir, table_bits)
+    service_codecs.clear()
+
+def service_codec(model_id: bytes) -> HuffmanCodec:
+    # NO_MODEL gives the codec without a model, which also decodes model containers through the store
+    if model_id not in service_codecs:
+        model = service_store.model(model_id) if model_id != NO_MODEL else None
+        service_codecs[model_id] = HuffmanCodec(table_bits=service_store.table_bits, model=model, model_store=service_store)
+    return service_codecs[model_id]
+
+def run_batch(op: int, model_id: bytes, bodies: List[bytes]) -> List[Tuple[int, bytes]]:
+    # Runs in a worker process, returns (status, response body) per request. One bad request doesn't fail the batch,
+    # whatever it raises is its own error response.
+    results: List[Tuple[int, bytes]] = list()
+    for body in bodies:
+        try:
+            if op == OP_COMPRESS:
+                results.append((STATUS_OK, service_codec(model_id).encode(body)))
+            else:
+                data = service_codec(NO_MODEL).decode(body)
+                results.append((STATUS_OK, data if isinstance(data, bytes) else data.encode('utf-8')))
+        except HuffmanError as e:
+            results.append((STATUS_ERROR, str(e).encode('utf-8')))
+        except Exception as e:
+            results.append((STATUS_ERROR, f"{type(e).__name__}: {e}".encode('utf-8')))
+    return results
+
+
+class HuffmanService:
+    def __init__(self, workers: int = None, model_dir: str = ".", table_bits: int = 8, batch_size: int = BATCH_SIZE,
+                 batch_delay: float = BATCH_DELAY, queue_size: int = QUEUE_SIZE) -> None:
+        self.workers: int = workers if workers is not None else default_workers()
+        self.model_dir: str = model_dir
+        self.table_bits: int = check_table_bits(table_bits)
+        self.batch_size: int = batch_size
+        self.batch_delay: float = batch_delay
+        self.queue_size: int = queue_size
+        self.stats: ServiceStats = ServiceStats()
+        self.queue: asyncio.Queue = None                # created by: start()
+        self.slots: asyncio.Semaphore = None            # created by: start(), in-flight batches
+        self.pool: ProcessPoolExecutor = None           # created by: start()
+        self.batcher: asyncio.Task = None               # created by: start()
+        self.running: set = set()                       # batch tasks, referenced until they finish
+        self.server: asyncio.AbstractServer = None      # created by: start()
+
+    async def start(self, unix_path: str = None, host: str = "127.0.0.1", port: int = 8765) -> asyncio.AbstractServer:
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.slots = asyncio.Semaphore(2 * self.workers)
+        self.pool = self.new_pool()
+        self.batcher = asyncio.create_task(self.batch_loop())
+        if unix_path is not None:
+            self.server = await asyncio.start_unix_server(self.handle_connection, path=unix_path)
+        else:
+            self.server = await asyncio.start_server(self.handle_connection, host=host, port=port)
+        return self.server
+
+    def new_pool(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=init_service_worker, initargs=(self.model_dir, self.table_bits))
+
+    async def close(self) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+        self.batcher.cancel()
+        self.pool.shutdown(cancel_futures=True)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                frame = await read_frame(reader)
+                if frame is None:
+                    break
+                request_id, op, model_id, body = frame
+                request = ServiceRequest(request_id, op, model_id, body, writer, loop.time())
+                if op == OP_STATS:
+                    await self.respond(request, STATUS_OK, json.dumps(self.stats.snapshot()).encode('utf-8'))
+                    continue
+                try:
+                    request.batch_key = self.batch_key(request)
+                except HuffmanError as e:
+                    await self.respond(request, STATUS_ERROR, str(e).encode('utf-8'))
+                    continue
+                # waits while the queue is full, which stops reading from this connection
+                await self.queue.put(request)
+        except (HuffmanError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def batch_key(self, request: ServiceRequest) -> Tuple[int, bytes]:
+        # Requests with the same key share a code table and go to the same batch.
+        if request.op == OP_COMPRESS:
+            return request.op, request.model_id
+        if request.op == OP_DECOMPRESS:
+            header = ContainerHeader.from_fd(io.BytesIO(request.body))
+            return request.op, header.table if header.table_kind == TABLE_MODEL else NO_MODEL
+        raise HuffmanError(f"unknown op = {request.op}")
+
+    async def batch_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            requests: List[ServiceRequest] = [await self.queue.get()]
+            deadline = loop.time() + self.batch_delay
+            while len(requests) < self.batch_size:
+                if not self.queue.empty():
+                    requests.append(self.queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    requests.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            for group in self.group_requests(requests):
+                await self.slots.acquire()
+                task = asyncio.create_task(self.run_group(group))
+                self.running.add(task)
+                task.add_done_callback(self.running.discard)
+
+    @staticmethod
+    def group_requests(requests: List[ServiceRequest]) -> List[List[ServiceRequest]]:
+        groups: Dict[Tuple[int, bytes], List[ServiceRequest]] = dict()
+        singles: List[List[ServiceRequest]] = list()
+        for request in requests:
+            if len(request.body) > SMALL_REQUEST:
+                singles.append([request])
+            else:
+                groups.setdefault(request.batch_key, list()).append(request)
+        return list(groups.values()) + singles
+
+    async def run_group(self, group: List[ServiceRequest]) -> None:
+        loop = asyncio.get_running_loop()
+        op, model_id = group[0].op, group[0].model_id
+        pool = self.pool
+        try:
+            results = await loop.run_in_executor(pool, run_batch, op, model_id, [request.body for request in group])
+        except BrokenProcessPool as e:
+            # a worker died (killed, out of memory), the pool takes no more tasks: the batches in flight fail and
+            # the first of them to get here replaces it for the ones after
+            if self.pool is pool:
+                pool.shutdown(wait=False, cancel_futures=True)
+                self.pool = self.new_pool()
+            results = [(STATUS_ERROR, f"{type(e).__name__}: {e}".encode('utf-8'))] * len(group)
+        except Exception as e:
+            results = [(STATUS_ERROR, f"{type(e).__name__}: {e}".encode('utf-8'))] * len(group)
+        finally:
+            self.slots.release()
+        self.stats.batches += 1
+        for request, (status, body) in zip(group, results):
+            await self.respond(request, status, body)
+
+    async def respond(self, request: ServiceRequest, status: int, body: bytes) -> None:
+        if request.op != OP_STATS:
+            latency = asyncio.get_running_loop().time() - request.received
+            self.stats.record(latency, len(request.body), len(body), status == STATUS_OK)
+        if request.writer.is_closing():
+            return
+        request.writer.write(pack_frame(request.request_id, status, body))
+        try:
+            # a client that doesn't read its responses slows down its own batches
+            await request.writer.drain()
+        except ConnectionError:
+            pass
+
+
+async def serve(args: argparse.Namespace) -> None:
+    service = HuffmanService(workers=args.workers, model_dir=args.model_dir, table_bits=args.table_bits, batch_size=args.batch_size,
+                             batch_delay=args.batch_delay_ms / 1000, queue_size=args.queue_size)
+    server = await service.start(unix_path=args.unix, host=args.host, port=args.port)
+    print(f"listening on {args.unix if args.unix is not None else f'{args.host}:{args.port}'} with {service.workers} workers")
+    try:
+        await server.serve_forever()
+    finally:
+        await service.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Huffman compression sidecar server.")
+    parser.add_argument("--unix", help="listen on this Unix socket path instead of TCP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, help="worker processes (default all cores)")
+    parser.add_argument("--model-dir", default=".", help="directory of trained .hufm models")
+    parser.add_argument("--table-bits", type=int, default=8, choices=range(1, MAX_TABLE_BITS + 1), metavar=f"1..{MAX_TABLE_BITS}")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--batch-delay-ms", type=float, default=1000 * BATCH_DELAY)
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+from typing import List, Dict, Tuple
+from array import array
+import heapq
+
+from huffman_format import HuffmanError
+
+# Array-backed code tree shared by compression_file.py and decompression_file.py.
+# Node i is left[i] / right[i] (child indexes, NO_NODE for a leaf) and symbols[i] (the code point of a leaf's character,
+# NO_NODE for an internal node). A left step is a 0 bit and a right step a 1 bit. The tree is built and walked with
+# explicit stacks, so no depth of tree ever meets the recursion limit, and a node costs 12 bytes instead of an object.
+
+NO_NODE: int = -1
+
+
+class HeapEntry:
+    # Heap item of from_histogram(), ordered by frequency only like the old HT_Node, so equal frequencies
+    # are merged in the same order and the trees (and compressed files) come out the same.
+    __slots__ = ("freq", "node")
+
+    def __init__(self, freq: int, node: int) -> None:
+        self.freq: int = freq
+        self.node: int = node
+
+    def __lt__(self, other: "HeapEntry") -> bool:
+        return self.freq < other.freq
+
+
+class CodeTree:
+    __slots__ = ("left", "right", "symbols", "root")
+
+    def __init__(self) -> None:
+        self.left: array = array('i')
+        self.right: array = array('i')
+        self.symbols: array = array('i')
+        self.root: int = NO_NODE        # NO_NODE for the empty tree of an empty input
+
+    def __len__(self) -> int:
+        return len(self.symbols)
+
+    def __repr__(self) -> str:
+        return f"CodeTree(nodes={len(self)}, leaves={sum(1 for symbol in self.symbols if symbol >= 0)})"
+
+    def add_node(self, symbol: int = NO_NODE, left: int = NO_NODE, right: int = NO_NODE) -> int:
+        self.left.append(left)
+        self.right.append(right)
+        self.symbols.append(symbol)
+        return len(self.symbols) - 1
+
+    def is_leaf(self, node: int) -> bool:
+        return self.left[node] == NO_NODE
+
+    def symbol(self, node: int) -> str:
+        return chr(self.symbols[node])
+
+    @classmethod
+    def from_histogram(cls, char_historgram: Dict[str, int]) -> "CodeTree":
+        # Huffman's construction: the two least frequent nodes are merged until one is left,
+        # the smaller one becomes the left (0) child.
+        tree = cls()
+        heap: List[HeapEntry] = list()
+        for char, freq in char_historgram.items():
+            if len(char) != 1:
+                raise HuffmanError(f"a symbol must be a single character, got {char!r}")
+            if freq <= 0:
+                raise HuffmanError(f"frequency doesn't make sense, freq = {freq}")
+            heap.append(HeapEntry(freq, tree.add_node(symbol=ord(char))))
+        if not heap:
+            return tree
+        heapq.heapify(heap)
+        while len(heap) > 1:
+            smaller = heapq.heappop(heap)
+            bigger = heapq.heappop(heap)
+            heapq.heappush(heap, HeapEntry(smaller.freq + bigger.freq, tree.add_node(left=smaller.node, right=bigger.node)))
+        tree.root = heap[0].node
+        return tree
+
+    @classmethod
+    def from_shape(cls, shape: List[int], symbols: str) -> "CodeTree":
+        # Rebuilds the tree from its preorder shape (1 = leaf, 0 = internal) and the leaf symbols in preorder.
+        tree = cls()
+        if not shape:
+            return tree
+        leaf_symbols = iter(symbols)
+        tree.root = tree.add_node()
+        stack: List[int] = [tree.root]
+        for is_leaf in shape:
+            if not stack:
+                raise HuffmanError("tree table shape has more nodes than the tree")
+            node = stack.pop()
+            if is_leaf:
+                symbol = next(leaf_symbols, None)
+                if symbol is None:
+                    raise HuffmanError("tree table shape has more leaves than symbols")
+                tree.symbols[node] = ord(symbol)
+                continue
+            tree.left[node] = tree.add_node()
+            tree.right[node] = tree.add_node()
+            stack.append(tree.right[node])
+            stack.append(tree.left[node])
+        if stack:
+            raise HuffmanError("tree table shape ends before the tree is complete")
+        return tree
+
+    @classmethod
+    def from_codes(cls, codes: Dict[str, Tuple[int, int]]) -> "CodeTree":
+        # Rebuilds the tree from symbol -> (code, length), one descent per code.
+        tree = cls()
+        if len(codes) == 1:
+            tree.root = tree.add_node(symbol=ord(next(iter(codes))))
+            return tree
+        if not codes:
+            return tree
+        tree.root = tree.add_node()
+        left, right = tree.left, tree.right
+        for symbol, (code, length) in codes.items():
+            node = tree.root
+            for shift in range(length - 1, -1, -1):
+                children = right if (code >> shift) & 1 else left
+                child = children[node]
+                if child == NO_NODE:
+                    child = tree.add_node()
+                    children[node] = child
+                node = child
+            tree.symbols[node] = ord(symbol)
+        return tree
+
+    @classmethod
+    def from_orders(cls, preorder: List[str], inorder: List[str]) -> "CodeTree":
+        # Rebuilds the tree of the legacy text format from its preorder and inorder lists of unique values,
+        # leaves hold their character and internal nodes a number. One pass with a stack, O(n).
+        tree = cls()
+        if not preorder:
+            return tree
+        if len(preorder) != len(inorder):
+            raise HuffmanError(f"preorder has {len(preorder)} values and inorder {len(inorder)}")
+        position: Dict[str, int] = {value: i for i, value in enumerate(inorder)}
+        labels: List[str] = list()
+        stack: List[int] = list()
+        for value in preorder:
+            if value not in position:
+                raise HuffmanError(f"{value!r} is in the preorder list but not in the inorder list")
+            node = tree.add_node()
+            labels.append(value)
+            if not stack:
+                tree.root = node
+            elif position[value] < position[labels[stack[-1]]]:
+                tree.left[stack[-1]] = node
+            else:
+                parent = stack.pop()
+                while stack and position[value] > position[labels[stack[-1]]]:
+                    parent = stack.pop()
+                tree.right[parent] = node
+            stack.append(node)
+        for node, label in enumerate(labels):
+            if tree.left[node] == NO_NODE and tree.right[node] == NO_NODE:
+                if len(label) != 1:
+                    raise HuffmanError(f"leaf value {label!r} isn't a single character")
+                tree.symbols[node] = ord(label)
+            elif tree.left[node] == NO_NODE or tree.right[node] == NO_NODE:
+                raise HuffmanError(f"node {label!r} has a single child, the orders don't describe a Huffman tree")
+        return tree
+
+    def preorder(self) -> List[int]:
+        nodes: List[int] = list()
+        stack: List[int] = [self.root] if self.root != NO_NODE else []
+        left, right = self.left, self.right
+        while stack:
+            node = stack.pop()
+            nodes.append(node)
+            if left[node] != NO_NODE:
+                stack.append(right[node])
+                stack.append(left[node])
+        return nodes
+
+    def inorder(self) -> List[int]:
+        nodes: List[int] = list()
+        stack: List[int] = list()
+        left, right = self.left, self.right
+        node = self.root
+        while stack or node != NO_NODE:
+            while node != NO_NODE:
+                stack.append(node)
+                node = left[node]
+            node = stack.pop()
+            nodes.append(node)
+            node = right[node]
+        return nodes
+
+    def leaf_codes(self) -> Dict[str, Tuple[int, int]]:
+        # symbol -> (code, length) of the path to every leaf, a single-leaf tree spends one 0 bit per symbol
+        if self.root == NO_NODE:
+            return dict()
+        if self.is_leaf(self.root):
+            return {self.symbol(self.root): (0, 1)}
+        codes: Dict[str, Tuple[int, int]] = dict()
+        left, right, symbols = self.left, self.right, self.symbols
+        stack: List[Tuple[int, int, int]] = [(self.root, 0, 0)]
+        while stack:
+            node, code, length = stack.pop()
+            if left[node] == NO_NODE:
+                codes[chr(symbols[node])] = (code, length)
+                continue
+            stack.append((right[node], (code << 1) | 1, length + 1))
+            stack.append((left[node], code << 1, length + 1))
+        return codes
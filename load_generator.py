@@ -0,0 +1,84 @@
+from typing import List
+import argparse
+import asyncio
+import random
+import json
+import time
+import os
+
+from huffman_client import HuffmanClient
+from huffman_model import HuffmanModel
+from huffman_server import percentile
+
+# Load generator for huffman_server.py. Sends `--requests` compress + decompress round trips of random
+# `--size` character slices of a corpus over `--connections` connections with `--concurrency` requests in flight,
+# checks every round trip and prints the client side latency percentiles, the throughput and the server stats.
+
+ALICE_PATH: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Alice_in_wonderlands.txt")
+
+
+async def run_client(client: HuffmanClient, messages: List[bytes], model_id: bytes, latencies: List[float], failures: List[str]) -> None:
+    for message in messages:
+        start = time.perf_counter()
+        try:
+            blob = await client.compress(message, model_id=model_id)
+            if await client.decompress(blob) != message:
+                failures.append("round trip mismatch")
+        except Exception as e:
+            failures.append(f"{type(e).__name__}: {e}")
+        latencies.append(time.perf_counter() - start)
+
+
+async def generate(args: argparse.Namespace) -> None:
+    with open(file=args.corpus, mode='r', encoding='utf-8') as fd:
+        corpus = fd.read()
+    rng = random.Random(args.seed)
+    messages: List[bytes] = list()
+    for _ in range(args.requests):
+        start = rng.randrange(max(1, len(corpus) - args.size))
+        messages.append(corpus[start:start + args.size].encode('utf-8'))
+    model_id = HuffmanModel.load(args.model).model_id if args.model is not None else None
+
+    clients = [await HuffmanClient.connect(unix_path=args.unix, host=args.host, port=args.port) for _ in range(args.connections)]
+    latencies: List[float] = list()
+    failures: List[str] = list()
+    start = time.perf_counter()
+    await asyncio.gather(*(run_client(clients[i % len(clients)], messages[i::args.concurrency], model_id, latencies, failures)
+                           for i in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+    server_stats = await clients[0].stats()
+    for client in clients:
+        await client.close()
+
+    sent_bytes = sum(len(message) for message in messages)
+    print(json.dumps({
+        "round_trips": len(messages),
+        "failures": len(failures),
+        "first_failure": failures[0] if failures else None,
+        "p50_ms": round(1000 * percentile(latencies, 0.50), 3),
+        "p99_ms": round(1000 * percentile(latencies, 0.99), 3),
+        "round_trips_per_s": round(len(messages) / elapsed, 1),
+        "mb_per_s": round(sent_bytes / 1e6 / elapsed, 3),
+        "server": server_stats,
+    }, indent=2))
+    if failures:
+        exit(1)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load generator for huffman_server.py.")
+    parser.add_argument("--unix", help="connect to this Unix socket path instead of TCP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--requests", type=int, default=10000, help="number of compress + decompress round trips")
+    parser.add_argument("--size", type=int, default=200, help="characters per message")
+    parser.add_argument("--concurrency", type=int, default=64, help="round trips in flight")
+    parser.add_argument("--connections", type=int, default=4)
+    parser.add_argument("--corpus", default=ALICE_PATH, help="text the messages are sliced from")
+    parser.add_argument("--model", help="path of a trained .hufm model to compress against")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(generate(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()